@@ -16,6 +16,16 @@
 
 import sys
 import re
+import hashlib
+import json
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr
+from functools import partial
+from glob import glob
+from io import BytesIO, StringIO
+from os import path
 
 # Opcodes
 OPCODES = {
@@ -56,20 +66,57 @@ OPCODES = {
     "ADDI": {"type": 8, "code": "10000000"},
 }
 
+# Opcode byte values
+OPCODE_BYTES = {name: int(info["code"], 2) for name, info in OPCODES.items()}
+
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
 REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+LINE = re.compile(REGEX)
+
+# Register names, and the pattern for anything else starting with one
+REGISTERS = {f"R{i}": i for i in range(8)}
+REGISTER = re.compile(r"R([0-7])")
+
+# Binary image (.ls8b) header, as read by CPU.load in ls8/cpu.py:
+# magic, version, word size, load address, entry point, code size, symbol
+# table size, CRC-32 of the code and symbol table. The symbol table is a
+# list of (address: 2 bytes little-endian, name length: 1 byte, name).
+IMAGE = struct.Struct("<4sBBHHHHI")
+IMAGE_MAGIC = b"LS8B"
+IMAGE_VERSION = 1
+
+# Peephole optimizer tables. R5-R7 are IM, IS and SP, whose writes have
+# side effects, so only R0-R4 are tracked or have writes removed.
+SCRATCH = {f"R{i}" for i in range(5)}
+ALL_REGISTERS = frozenset(REGISTERS)
+
+# Opcodes that write their first operand
+WRITES_A = {"ADD", "ADDI", "AND", "DEC", "DIV", "INC", "LD", "LDI", "MOD",
+            "MUL", "NOT", "OR", "POP", "SHL", "SHR", "SUB", "XOR"}
+
+# Opcodes whose only effect is that write. DIV and MOD can halt.
+PURE = WRITES_A - {"DIV", "MOD", "POP"}
+
+# Opcodes after which register values can not be followed: the next
+# instruction is a jump target, or a call may have changed anything
+TRANSFERS = {"CALL", "HLT", "INT", "IRET", "JMP", "RET"}
 
-# Regex for capturing DS and DB data
-REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
-REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
+# Opcodes that may continue somewhere else, reading any register there
+BRANCHES = TRANSFERS | {"JEQ", "JGE", "JGT", "JLE", "JLT", "JNE"}
 
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [--wide] [-O] [inputfile] [outputfile]
+           asm.py --all [--force] [--jobs=N] [--wide] [-O] [srcdir [outdir]]
+
+    An outputfile ending in .ls8b gets a binary image instead of text.
+    -O runs the peephole optimizer.
     """
 
+    argv = [arg for arg in argv if arg not in ("--wide", "-O")]
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -83,7 +130,8 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [--wide] [-O] [infile.asm] "
+              "[outfile.ls8|.ls8b]", file=sys.stderr)
         sys.exit(1)
 
     return inputfile, outputfile
@@ -102,33 +150,276 @@ def open_files(inputfile, outputfile):
 
     if outputfile == "-":
         outputfile = sys.stdout
+    elif outputfile.endswith(".ls8b"):
+        outputfile = open(outputfile, "wb")
     else:
         outputfile = open(outputfile, "w")
 
     return inputfile, outputfile
 
 
-def normalize_line(groups):
+def tokenize(lines):
     """
-    Takes match groups and uppercases them if they're not None.
+    Strip comments and split each source line into its parts, once.
+
+    Yields (line number, label, opcode, operandA, operandB) for every
+    line with a label or an opcode, with names uppercased. For DS and DB,
+    operandA is the argument text as written and operandB is None.
     """
 
-    result = []
+    match = LINE.match
 
-    for g in groups:
-        if g is None:
-            result.append(None)
-        else:
-            result.append(g.upper())
+    for line_num, line in enumerate(lines, 1):
+        line = line.partition(';')[0].strip()
+
+        # Ignore blank lines
+        if not line:
+            continue
 
-    return result
+        m = match(line)
+        label, opcode, op_a, op_b = m.groups()
+
+        if opcode is not None:
+            opcode = opcode.upper()
+
+            if opcode == "DS" or opcode == "DB":
+                # The argument is the rest of the line
+                op_a, op_b = line[m.end(2):].lstrip(), None
+
+                if not op_a:
+                    print(f"line {line_num}: missing argument to {opcode}",
+                          file=sys.stderr)
+                    sys.exit(2)
+
+            else:
+                if op_a is not None:
+                    op_a = op_a.upper()
+
+                if op_b is not None:
+                    op_b = op_b.upper()
+
+        elif label is None:
+            continue
+
+        if label is not None:
+            label = label.upper()
+
+        yield line_num, label, opcode, op_a, op_b
+
+
+# Binary strings of every byte value
+P8 = ["{:08b}".format(v) for v in range(256)]
 
 
 def p8(v):
-    return "{:08b}".format(v)
+    return P8[v] if 0 <= v < 256 else "{:08b}".format(v)
+
+
+def get_reg(op, line_num):
+    """Get a register number from a string, e.g. "R2" -> 2"""
+
+    reg = REGISTERS.get(op)
+
+    if reg is None:
+        m = REGISTER.match(op)
+
+        if m is None:
+            print(f"Line {line_num}: unknown register {op}", file=sys.stderr)
+            sys.exit(1)
+
+        reg = int(m.group(1))
+
+    return reg
+
+
+def check_ops(opcode, op_a, op_b, line_num):
+    """Check operands for sanity with a particular opcode"""
+
+    # Make sure we know this opcode at all
+    if opcode not in OPCODES:
+        print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
+        sys.exit(2)
+
+    op_type = OPCODES[opcode]["type"]
+
+    # 0, 1, or 2 register operands, or LDI r,i or LDI r,label (type 8)
+    desired = 2 if op_type == 8 else op_type
+    found = (op_a is not None) + (op_b is not None)
+
+    # Makes sure we have right operand count
+    if found < desired:
+        print(f"Line {line_num}: missing operand to {opcode}",
+              file=sys.stderr)
+        sys.exit(1)
+    elif found > desired:
+        print(f"Line {line_num}: unexpected operand to {opcode}",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+def parse_db(data, line_num):
+    """Return the byte value of a DB argument."""
+
+    try:
+        val = int(data, 0)
+
+    except ValueError:
+        print(f"line {line_num}: invalid integer argument to DB",
+              file=sys.stderr)
+        sys.exit(2)
+
+    # Force to byte size
+    return val & 0xff
+
+
+def check_range(val, bits, what, line_num=None):
+    """
+    Return val if it fits in `bits` unsigned bits, else report it and
+    exit. Both assemblers check the same values, so the text and binary
+    outputs of a source never differ.
+    """
+
+    if not 0 <= val < 1 << bits:
+        where = "" if line_num is None else f"line {line_num}: "
+        print(f"{where}{what} out of range: {val}", file=sys.stderr)
+        sys.exit(2)
+
+    return val
+
 
+def effects(opcode, op_a, op_b, line_num):
+    """Return the registers an instruction reads and writes."""
 
-def pass1(inputfile, sym, code):
+    op_type = OPCODES[opcode]["type"]
+    reads, writes = set(), set()
+
+    if op_type:
+        reg_a = f"R{get_reg(op_a, line_num)}"
+
+        if opcode in WRITES_A:
+            writes.add(reg_a)
+
+        if opcode not in ("LD", "LDI", "POP"):
+            reads.add(reg_a)
+
+    if op_type == 2:
+        reads.add(f"R{get_reg(op_b, line_num)}")
+
+    return reads, writes
+
+
+def peephole(tokens):
+    """
+    Peephole optimizer
+
+    Rewrites the (line number, label, opcode, operandA, operandB) tuples
+    from `tokenize` before they are assembled, so labels get the
+    addresses of the smaller program:
+
+    * LDI of the value a register already holds is removed
+    * ADD of a register known to hold a constant that fits in a byte
+      becomes ADDI. Only CMP sets FL, so the flags are the same.
+    * An instruction whose only effect is writing a register is removed
+      if the register is written again before it is read
+
+    Register values are only followed through straight-line code. A
+    label no LDI loads is only reached by falling through to it, so it
+    keeps them. Any other label, DS/DB, call, jump or return forgets them
+    all, and every register counts as read there: nothing is carried
+    across a label that is a jump or call target, so loops get no benefit.
+    None are read after HLT. This assumes code addresses are only taken
+    through labels, never as numbers.
+    """
+
+    tokens = list(tokens)
+
+    # Labels some LDI loads, the only ones jumps and calls can reach
+    targets = {op_b for _, _, opcode, _, op_b in tokens if opcode == "LDI"}
+
+    # Forward: remove reloads and fold constants into ADDI
+    known = {}  # register -> constant or symbol it holds
+    folded = []
+
+    for token in tokens:
+        line_num, label, opcode, op_a, op_b = token
+
+        if label in targets:
+            known.clear()
+
+        if opcode is None:
+            folded.append(token)
+            continue
+
+        if opcode == "DS" or opcode == "DB":
+            known.clear()
+            folded.append(token)
+            continue
+
+        check_ops(opcode, op_a, op_b, line_num)
+        writes = effects(opcode, op_a, op_b, line_num)[1]
+
+        if opcode == "LDI":
+            try:
+                value = int(op_b, 0)
+            except ValueError:
+                value = op_b
+
+            reg_a = f"R{get_reg(op_a, line_num)}"
+
+            if reg_a in SCRATCH and known.get(reg_a) == value:
+                continue
+
+        elif opcode == "ADD":
+            value = known.get(f"R{get_reg(op_b, line_num)}")
+
+            if isinstance(value, int) and 0 <= value <= 0xff \
+                    and get_reg(op_a, line_num) != get_reg(op_b, line_num):
+                token = (line_num, label, "ADDI", op_a, str(value))
+
+        for reg in writes:
+            known.pop(reg, None)
+
+        if opcode == "LDI" and reg_a in SCRATCH:
+            known[reg_a] = value
+
+        elif opcode in TRANSFERS:
+            known.clear()
+
+        folded.append(token)
+
+    # Backward: remove writes nothing reads
+    live = ALL_REGISTERS
+    kept = []
+
+    for token in reversed(folded):
+        line_num, label, opcode, op_a, op_b = token
+
+        if opcode == "HLT":
+            live = frozenset()
+
+        elif opcode in BRANCHES or opcode == "DS" or opcode == "DB":
+            live = ALL_REGISTERS
+
+        elif opcode is not None:
+            reads, writes = effects(opcode, op_a, op_b, line_num)
+
+            if opcode in PURE and writes <= SCRATCH and not writes & live:
+                token = (line_num, label, None, None, None)
+            else:
+                live = (live - writes) | reads
+
+        if label in targets:
+            live = ALL_REGISTERS
+
+        if token[1:3] != (None, None):
+            kept.append(token)
+
+    kept.reverse()
+
+    return kept
+
+
+def pass1(inputfile, sym, code, wide=False, optimize=False):
     """
     Pass 1
 
@@ -136,6 +427,10 @@ def pass1(inputfile, sym, code):
     * Parse labels, opcodes, and operands
     * Record label offsets
     * Emit machine code
+
+    With `wide`, LDI takes a two-byte little-endian immediate, for the
+    emulator's 16-bit mode. With `optimize`, the source goes through
+    `peephole` first.
     """
 
     # Source line number
@@ -144,23 +439,6 @@ def pass1(inputfile, sym, code):
     # Current code address (for labels)
     addr = 0
 
-    def get_reg(op, fatal=True):
-        """Get a register number from a string, e.g. "R2" -> 2"""
-
-        nonlocal line_num
-
-        m = re.match(r"R([0-7])", op)
-
-        if m is None:
-            if fatal:
-                print(f"Line {line_num}: unknown register {op}",
-                      file=sys.stderr)
-                sys.exit(1)
-            else:
-                return None
-
-        return int(m.group(1))
-
     def out0(opcode, op_a, op_b, machine_code):
         """Handle opcodes with zero operands"""
 
@@ -174,7 +452,7 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        reg_a = get_reg(op_a)
+        reg_a = get_reg(op_a, line_num)
         code.append(f"{machine_code} # {opcode} {op_a}")
         code.append(p8(reg_a))
         addr += 2
@@ -184,8 +462,8 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        reg_a = get_reg(op_a)
-        reg_b = get_reg(op_b)
+        reg_a = get_reg(op_a, line_num)
+        reg_b = get_reg(op_b, line_num)
 
         code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
         code.append(p8(reg_a))
@@ -198,38 +476,46 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        reg_a = get_reg(op_a)
+        reg_a = get_reg(op_a, line_num)
 
         try:
             val_b = int(op_b, 0)
-            out_b = p8(val_b)
 
         except ValueError:
             # If it's not a value, it might be a symbol
-            out_b = f"sym:{op_b}"
+            val_b = None
+
+        if val_b is not None:
+            check_range(val_b, 16 if wide and opcode == "LDI" else 8,
+                        "immediate", line_num)
 
         code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
         code.append(p8(reg_a))
-        code.append(out_b)
 
-        addr += 3
+        if wide and opcode == "LDI":
+            # Two-byte little-endian immediate
+            for shift in (0, 8):
+                if val_b is None:
+                    code.append(f"sym:{op_b}>>{shift}")
+                else:
+                    code.append(p8(val_b >> shift & 0xff))
+
+            addr += 4
+
+        else:
+            code.append(f"sym:{op_b}" if val_b is None else p8(val_b))
+
+            addr += 3
 
-    def handle_ds(line):
+    def handle_ds(data):
         """
         Handle DS pseudo-opcode
         """
 
         nonlocal addr
 
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
-
-        if m is None or m.group(2) is None:
-            print(f"line {line_num}: missing argument to DS", file=sys.stderr)
-            sys.exit(2)
-
-        data = m.group(2)
-
         for i in range(len(data)):
+            check_range(ord(data[i]), 8, "DS character", line_num)
             print_char = data[i]
 
             if print_char == ' ':
@@ -239,156 +525,364 @@ def pass1(inputfile, sym, code):
 
         addr += len(data)
 
-    def handle_db(line):
+    def handle_db(data):
         """
         Handle the DB pseudo-opcode
         """
 
         nonlocal addr
 
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+        val = parse_db(data, line_num)
 
-        if m is None or m.group(2) is None:
-            print(f"line {line}: missing argument to DB", file=sys.stderr)
-            sys.exit(2)
+        code.append(f"{p8(val)} # {data}")
 
-        data = m.group(2)
+        addr += 1
 
-        try:
-            val = int(data, 0)
+    # Type to function mapping
+    type_f = {
+        0: out0,
+        1: out1,
+        2: out2,
+        8: out8,
+    }
 
-        except ValueError:
-            print(f"line {line_num}: invalid integer argument to DB",
-                  file=sys.stderr)
-            sys.exit(2)
+    tokens = tokenize(inputfile)
 
-        # Force to byte size
-        val &= 0xff
+    if optimize:
+        tokens = peephole(tokens)
 
-        code.append(f"{p8(val)} # {data}")
+    for line_num, label, opcode, op_a, op_b in tokens:
+        # print(label, opcode, op_a, op_b)  # debug
 
-        addr += 1
+        # Track label address
+        if label is not None:
+            sym[label] = addr
+            # print(f"Label {label}: {addr}")  # debug
+            code.append(f'# {label} (address {addr}):')
 
-    def check_ops(opcode, op_a, op_b):
-        """Check operands for sanity with a particular opcode"""
-
-        def check_ops_count(desired, found):
-            # Makes sure we have right operand count
-            if found < desired:
-                print(f"Line {line_num}: missing operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
-            elif found > desired:
-                print(f"Line {line_num}: unexpected operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
-
-        # Make sure we know this opcode at all
-        if opcode not in OPCODES:
-            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
-            sys.exit(2)
+        if opcode is not None:
+            if opcode == 'DS':
+                handle_ds(op_a)
+            elif opcode == 'DB':
+                handle_db(op_a)
+            else:
+                # Check operand count
+                check_ops(opcode, op_a, op_b, line_num)
 
-        op_type = OPCODES[opcode]["type"]
+                # Handle opcodes
+                op_info = OPCODES[opcode]
+                handler = type_f[op_info["type"]]
+                handler(opcode, op_a, op_b, op_info["code"])
 
-        total_operands = 0
 
-        if op_a is not None:
-            total_operands += 1
+def assemble(lines, wide=False, optimize=False):
+    """
+    Single-pass assembler
 
-        if op_b is not None:
-            total_operands += 1
+    Reads source lines lazily from any iterable and writes machine code
+    straight into a bytearray. Every label reference is recorded in a
+    fixup table and patched in place at the end, when the last
+    definition of each label is known, as in `pass2`; time is linear in
+    the source and memory is the program itself.
 
-        if op_type == 0 or op_type == 1 or op_type == 2:
-            # 0, 1, or 2 register operands
-            check_ops_count(op_type, total_operands)
+    With `optimize`, the source goes through `peephole` first.
 
-        elif op_type == 8:
-            # LDI r,i or LDI r,label
-            check_ops_count(2, total_operands)
+    Returns the program bytes and the symbol table.
+    """
 
-    # Type to function mapping
-    type_f = {
-        0: out0,
-        1: out1,
-        2: out2,
-        8: out8,
-    }
+    program = bytearray()
+    sym = {}
 
-    for line in inputfile:
-        line_num += 1
+    # Label references: (offset, symbol, shift, bits, source line number)
+    fixups = []
 
-        # Strip comments
-        comment_index = line.find(';')
-        if comment_index != -1:
-            line = line[:comment_index]
+    tokens = tokenize(lines)
 
-        # Normalize
-        line = line.strip()
+    if optimize:
+        tokens = peephole(tokens)
 
-        # Ignore blank lines
-        if input == '':
+    for line_num, label, opcode, op_a, op_b in tokens:
+        if label is not None:
+            sym[label] = len(program)
+
+        if opcode is None:
             continue
 
-        # print(line)  # debug
+        if opcode == 'DS':
+            program += bytes(
+                check_range(ord(c), 8, "DS character", line_num)
+                for c in op_a)
+            continue
 
-        m = re.match(REGEX, line)
+        if opcode == 'DB':
+            program.append(parse_db(op_a, line_num))
+            continue
 
-        if m is not None:
-            label, opcode, op_a, op_b = normalize_line(m.groups())
+        check_ops(opcode, op_a, op_b, line_num)
+        program.append(OPCODE_BYTES[opcode])
+        op_type = OPCODES[opcode]["type"]
 
-            # print(label, opcode, op_a, op_b)  # debug
+        if op_type == 0:
+            continue
 
-            # Track label address
-            if label is not None:
-                sym[label] = addr
-                # print(f"Label {label}: {addr}")  # debug
-                code.append(f'# {label} (address {addr}):')
+        program.append(get_reg(op_a, line_num))
 
-            if opcode is not None:
-                if opcode == 'DS':
-                    handle_ds(line)
-                elif opcode == 'DB':
-                    handle_db(line)
-                else:
-                    # Check operand count
-                    check_ops(opcode, op_a, op_b)
+        if op_type == 2:
+            program.append(get_reg(op_b, line_num))
+            continue
 
-                    # Handle opcodes
-                    op_info = OPCODES[opcode]
-                    handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
-        else:
-            print(f"No match: {input}", file=sys.stderr)
-            sys.exit(3)
+        if op_type == 8:
+            # LDI takes a two-byte immediate in wide mode
+            shifts = (0, 8) if wide and opcode == "LDI" else (0,)
 
+            try:
+                val_b = int(op_b, 0)
 
-def pass2(outputfile, sym, code):
+            except ValueError:
+                # A symbol, resolved at the end
+                for shift in shifts:
+                    fixups.append((len(program), op_b, shift,
+                                   8 * len(shifts), line_num))
+                    program.append(0)
+
+            else:
+                check_range(val_b, 8 * len(shifts), "immediate", line_num)
+                for shift in shifts:
+                    program.append(val_b >> shift & 0xff)
+
+    # Backpatch label references
+    for offset, s, shift, bits, line_num in fixups:
+        if s not in sym:
+            print(f"unknown symbol: {s}", file=sys.stderr)
+            sys.exit(2)
+
+        check_range(sym[s], bits, f"symbol {s}")
+        program[offset] = sym[s] >> shift & 0xff
+
+    return program, sym
+
+
+def resolve(sym, code):
     """
-    Output the code, substituting in any symbols.
+    Generate the code lines, substituting in any symbols.
     """
 
     for c in code:
         # Replace symbols
         if c[:4] == 'sym:':
-            s = c[4:].strip()
+            s, _, shift = c[4:].strip().partition('>>')
 
             if s in sym:
-                c = p8(sym[s])
+                if shift:
+                    # One byte of a wide symbol
+                    check_range(sym[s], 16, f"symbol {s}")
+                    c = p8(sym[s] >> int(shift) & 0xff)
+                else:
+                    c = p8(check_range(sym[s], 8, f"symbol {s}"))
 
             else:
                 print(f"unknown symbol: {s}", file=sys.stderr)
                 sys.exit(2)
 
-        outputfile.write(f"{c}\n")
+        yield c
+
+
+def pass2(outputfile, sym, code):
+    """
+    Output the code, substituting in any symbols.
+    """
+
+    outputfile.writelines(f"{c}\n" for c in resolve(sym, code))
+
+
+def write_image(outputfile, program, sym, wide=False):
+    """
+    Write machine code and its symbol table as a binary .ls8b image.
+    """
+
+    symbols = bytearray()
+    for label, address in sym.items():
+        name = label.encode()
+        symbols += struct.pack("<HB", address, len(name)) + name
+
+    header = IMAGE.pack(
+        IMAGE_MAGIC, IMAGE_VERSION, 16 if wide else 8,
+        0,  # load address
+        0,  # entry point
+        len(program), len(symbols), zlib.crc32(program + symbols)
+    )
+
+    outputfile.write(header + program + symbols)
+
+
+def assemble_file(inputfile, outputfile, wide=False, optimize=False):
+    """
+    Assemble one source file into an output file, in this process.
+
+    Returns None on success, or the error the assembler reported. The
+    output file is only written if assembly succeeds.
+    """
+
+    errors = StringIO()
+
+    try:
+        with redirect_stderr(errors), open(inputfile) as f:
+            if outputfile.endswith(".ls8b"):
+                program, sym = assemble(f, wide, optimize)
+                out = BytesIO()
+                write_image(out, program, sym, wide)
+            else:
+                sym, code = {}, []
+                pass1(f, sym, code, wide, optimize)
+                out = StringIO()
+                pass2(out, sym, code)
+
+        with open(outputfile, "wb" if isinstance(out, BytesIO) else "w") as f:
+            f.write(out.getvalue())
+
+    except SystemExit:
+        return errors.getvalue().strip() or "assembly failed"
+
+    except OSError as ex:
+        return str(ex)
+
+    return None
+
+
+# Records, in the output directory of `build_all`, the build key of each
+# output it wrote
+BUILD_RECORD = ".asm-build.json"
+
+
+def build_key(source, wide=False, optimize=False):
+    """
+    Return a digest of what an output is built from: the source text,
+    the options and the assembler itself.
+    """
+
+    digest = hashlib.sha256(f"wide={wide} optimize={optimize}".encode())
+    for name in (__file__, source):
+        with open(name, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def build_all(sources, outdir, jobs=None, wide=False, force=False,
+              optimize=False):
+    """
+    Assemble source files into .ls8 files in outdir, across `jobs`
+    processes.
+
+    Sources whose output was built from the same source text, with the
+    same options and by the same assembler are skipped, unless `force`;
+    their build keys are kept in `BUILD_RECORD` in outdir. Yields
+    (source, output, error) in source order, where error is None when
+    the file was built and "up to date" when skipped.
+    """
+
+    outputs = [
+        path.join(outdir, path.splitext(path.basename(source))[0] + ".ls8")
+        for source in sources
+    ]
+
+    record_file = path.join(outdir, BUILD_RECORD)
+    try:
+        with open(record_file) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        record = {}
+    if not isinstance(record, dict):
+        record = {}
+
+    keys = [build_key(source, wide, optimize) for source in sources]
+    stale = [
+        (source, output) for source, output, key in zip(sources, outputs, keys)
+        if force or not path.exists(output)
+        or record.get(path.basename(output)) != key
+    ]
+
+    build = partial(assemble_file, wide=wide, optimize=optimize)
+    inputs = [source for source, _ in stale]
+    targets = [output for _, output in stale]
+
+    # A single file is not worth starting a pool for
+    if jobs == 1 or len(stale) < 2:
+        errors = list(map(build, inputs, targets))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            errors = list(executor.map(build, inputs, targets))
+
+    errors = dict(zip(inputs, errors))
+
+    for source, output, key in zip(sources, outputs, keys):
+        if source in errors:
+            if errors[source] is None:
+                record[path.basename(output)] = key
+            else:
+                record.pop(path.basename(output), None)
+    if stale:
+        with open(record_file, "w") as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+
+    for source, output in zip(sources, outputs):
+        yield source, output, errors.get(source, "up to date")
+
+
+def main_all(argv):
+    """
+    Usage: asm.py --all [--force] [--jobs=N] [--wide] [-O] [srcdir [outdir]]
+
+    Assemble every .asm file in srcdir (default: this directory) into
+    outdir (default: ../ls8/examples), skipping up to date outputs.
+    """
+
+    args = [arg for arg in argv[1:] if not arg.startswith("-")]
+    flags = [arg for arg in argv[1:] if arg.startswith("-")]
+    jobs = [flag for flag in flags if flag.startswith("--jobs=")]
+
+    if len(args) > 2 or not set(flags) - set(jobs) <= {
+            "--all", "--force", "--wide", "-O"}:
+        print("usage: asm.py --all [--force] [--jobs=N] [--wide] [-O] "
+              "[srcdir [outdir]]", file=sys.stderr)
+        return 1
+
+    here = path.dirname(path.realpath(__file__))
+    srcdir = args[0] if args else here
+    outdir = args[1] if len(args) > 1 else \
+        path.join(path.dirname(here), "ls8", "examples")
+
+    failed = 0
+    for source, output, error in build_all(
+            sorted(glob(path.join(srcdir, "*.asm"))), outdir,
+            int(jobs[-1][7:]) if jobs else None, "--wide" in flags,
+            "--force" in flags, "-O" in flags):
+        if error is None:
+            print(f"{source} -> {output}")
+        elif error != "up to date":
+            print(f"{source}: {error}", file=sys.stderr)
+            failed += 1
+
+    return 1 if failed else 0
 
 
 def main(argv):
+    if "--all" in argv:
+        return main_all(argv)
+
     # Parse command line
+    wide = "--wide" in argv
+    optimize = "-O" in argv
     inputfile, outputfile = parse_commandline(argv)
 
     # Open files
     inputfile, outputfile = open_files(inputfile, outputfile)
 
+    # Binary images need no listing, so assemble them in one pass
+    if "b" in getattr(outputfile, "mode", ""):
+        program, sym = assemble(inputfile, wide, optimize)
+        write_image(outputfile, program, sym, wide)
+        return 0
+
     # Set up the symbol table
     sym = {}
 
@@ -396,7 +890,7 @@ def main(argv):
     code = []
 
     # Assemble
-    pass1(inputfile, sym, code)
+    pass1(inputfile, sym, code, wide, optimize)
     pass2(outputfile, sym, code)
 
     return 0
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""Benchmarks for the LS-8 emulator and assembler.
+
+Workloads are the example programs plus generated long-running ones: a
+multiply/compare loop nest and deep CALL/RET recursion. Every workload
+runs headless with a `VirtualTimer`, so the instruction count of a run
+is the same on every machine and engine; only the time differs.
+
+For each engine and workload the best of `--repeat` runs is reported as
+instructions per second and ns per instruction, along with the peak
+Python memory allocated during one run. The assembler is timed on a
+generated source of 25,000 lines per `--scale` (100,000 by default) and
+reported in lines per second, both with the two-pass text assembler and
+the single-pass `asm.assemble`.
+
+Usage:
+
+    python bench.py [--engines=checked,fast,jit] [--repeat=N]
+                    [--scale=N] [--tables] [--save=FILE] [--baseline=FILE]
+
+`--tables` runs the ALU on its lookup tables (`CPU(tables=True)`).
+
+`--save` writes the results as JSON, `--baseline` compares against a
+previously saved file, printing the speedup for each measurement.
+"""
+
+import io
+import json
+import platform
+import sys
+import tracemalloc
+from os.path import basename, dirname, join, realpath
+from glob import glob
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+ROOT = dirname(dirname(realpath(__file__)))
+sys.path[:0] = [join(ROOT, 'ls8'), join(ROOT, 'asm')]
+
+import asm  # noqa: E402
+from cpu import CPU, ENGINES  # noqa: E402
+from keyboard import Keyboard  # noqa: E402
+from output import Output  # noqa: E402
+from timer import VirtualTimer  # noqa: E402
+
+TIMER_PERIOD = 1000  # cycles between timer interrupts
+MAX_CYCLES = 200_000  # budget for programs that never halt
+ASM_LINES = 25_000  # assembler benchmark source lines per scale
+
+MUL_LOOP = """\
+; {outer} x {inner} multiply/compare loop
+    LDI R0,{outer}
+    LDI R2,1
+    LDI R3,3
+Outer:
+    LDI R1,{inner}
+Inner:
+    MUL R2,R3
+    ADD R2,R1
+    DEC R1
+    LDI R4,0
+    CMP R1,R4
+    LDI R4,Inner
+    JNE R4
+    DEC R0
+    LDI R4,0
+    CMP R0,R4
+    LDI R4,Outer
+    JNE R4
+    PRN R2
+    HLT
+"""
+
+RECURSION = """\
+; recurse {depth} calls deep, {times} times
+    LDI R0,{times}
+Again:
+    LDI R1,{depth}
+    LDI R4,Recurse
+    CALL R4
+    DEC R0
+    LDI R4,0
+    CMP R0,R4
+    LDI R4,Again
+    JNE R4
+    HLT
+Recurse:
+    DEC R1
+    LDI R4,0
+    CMP R1,R4
+    LDI R4,Done
+    JEQ R4
+    LDI R4,Recurse
+    CALL R4
+Done:
+    RET
+"""
+
+
+def assemble(source):
+    """Assemble source text, return the .ls8 text."""
+    sym, code = {}, []
+    asm.pass1(io.StringIO(source), sym, code)
+    out = io.StringIO()
+    asm.pass2(out, sym, code)
+    return out.getvalue()
+
+
+def workloads(scale, tmp):
+    """Return `(name, path)` of every workload, writing generated ones."""
+    examples = sorted(glob(join(ROOT, 'ls8', 'examples', '*.ls8')))
+    programs = [(basename(path)[:-4], path) for path in examples]
+    generated = {
+        'mul_loop': MUL_LOOP.format(outer=min(255, 25 * scale), inner=200),
+        'recursion': RECURSION.format(depth=150, times=min(255, 25 * scale)),
+    }
+    for name, source in generated.items():
+        path = join(tmp, f'{name}.ls8')
+        with open(path, 'w') as f:
+            f.write(assemble(source))
+        programs.append((name, path))
+    return programs
+
+
+def run_once(engine, path, tables=False):
+    """Load and run a program, return `(cycles, seconds, reason)`."""
+    cpu = CPU(engine=engine, timer=VirtualTimer(TIMER_PERIOD),
+              keyboard=Keyboard(io.StringIO()), output=Output(bytearray()),
+              tables=tables)
+    cpu.load(path)
+    start = perf_counter()
+    try:
+        reason = cpu.run(max_cycles=MAX_CYCLES)
+    except Exception:
+        reason = 'fault'
+    return cpu.cycles, perf_counter() - start, reason
+
+
+def peak_memory(engine, path, tables=False):
+    """Peak bytes allocated by Python during one run."""
+    tracemalloc.start()
+    try:
+        run_once(engine, path, tables)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_cpu(engines, programs, repeat, tables=False):
+    """Time every program on every engine, return the results."""
+    results = {}
+    for engine in engines:
+        for name, path in programs:
+            cycles, seconds, reason = min(
+                (run_once(engine, path, tables) for _ in range(repeat)),
+                key=lambda result: result[1])
+            results[f'{engine}/{name}'] = {
+                'instructions': cycles,
+                'seconds': seconds,
+                'instr_per_s': cycles / seconds if seconds else 0.0,
+                'ns_per_instr': 1e9 * seconds / cycles if cycles else 0.0,
+                'peak_bytes': peak_memory(engine, path, tables),
+                'reason': reason,
+            }
+    return results
+
+
+def bench_asm(scale, repeat):
+    """Time the assembler on a large generated source."""
+    # every copy defines its labels, but jumps to the first copy's, as
+    # later ones are past the 8-bit address range
+    body = MUL_LOOP
+    for label in ('Outer', 'Inner'):
+        body = body.replace(f'{label}:', label + '{n}:')
+        body = body.replace(f',{label}', f',{label}0')
+    body += 'Text{n}: DS Hello, world {n}\n    DB 0x0a  ; newline\n'
+    copies = ASM_LINES * scale // body.count('\n')
+    source = ''.join(body.replace('{n}', str(n)).format(outer=1, inner=1)
+                     for n in range(copies))
+    lines = source.count('\n')
+    results = {}
+    for name, func in (('asm/mul_loop', assemble),
+                       ('asm/stream', stream_assemble)):
+        seconds = min(timed(func, source) for _ in range(repeat))
+        results[name] = {
+            'lines': lines,
+            'seconds': seconds,
+            'lines_per_s': lines / seconds,
+        }
+    return results
+
+
+def stream_assemble(source):
+    """Assemble source text in one pass, return the machine code."""
+    return asm.assemble(io.StringIO(source))[0]
+
+
+def timed(func, *args):
+    """Seconds taken by one call."""
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+def report(results, baseline=None):
+    """Print a table of results, with speedups over a baseline."""
+    for name, result in results.items():
+        if 'lines_per_s' in result:
+            rate, key = f"{result['lines_per_s']:12,.0f} lines/s", \
+                'lines_per_s'
+            detail = f"{result['lines']:,} lines"
+        else:
+            rate, key = f"{result['instr_per_s']:12,.0f} instr/s", \
+                'instr_per_s'
+            detail = (f"{result['ns_per_instr']:9,.0f} ns/instr "
+                      f"{result['peak_bytes'] / 1024:8,.0f} KiB "
+                      f"{result['instructions']:>9,} {result['reason']}")
+        line = f'{name:24} {rate} {detail}'
+        if baseline and name in baseline and baseline[name].get(key):
+            line += f'  x{result[key] / baseline[name][key]:.2f}'
+        print(line)
+
+
+def main(argv):
+    flags = dict(
+        flag[2:].split('=', 1) if '=' in flag else (flag[2:], None)
+        for flag in argv[1:]
+    )
+    engines = flags.get('engines', ','.join(ENGINES)).split(',')
+    repeat = int(flags.get('repeat', 3))
+    scale = int(flags.get('scale', 4))
+    known = {'engines', 'repeat', 'scale', 'tables', 'save', 'baseline'}
+    if not set(flags) <= known \
+            or not set(engines) <= set(ENGINES):
+        print(__doc__.split('Usage:')[1].split('`--save`')[0].strip(),
+              file=sys.stderr)
+        return 1
+
+    baseline = None
+    if flags.get('baseline'):
+        with open(flags['baseline']) as f:
+            baseline = json.load(f)['results']
+
+    with TemporaryDirectory() as tmp:
+        results = bench_cpu(engines, workloads(scale, tmp), repeat,
+                            'tables' in flags)
+    results.update(bench_asm(scale, repeat))
+    report(results, baseline)
+
+    if flags.get('save'):
+        with open(flags['save'], 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'repeat': repeat,
+                'scale': scale,
+                'tables': 'tables' in flags,
+                'results': results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
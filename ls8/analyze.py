@@ -0,0 +1,396 @@
+"""Static analysis and control-flow graphs of loaded LS-8 programs.
+
+`analyze` disassembles the program reachable from the CPU's current
+state and builds its control-flow graph. Register-indirect jumps and
+calls are resolved by propagating constants through the registers, which
+follows the `LDI Rn,label` / `JMP Rn` pattern asm.py emits. Each CALL
+target is analyzed as a function, and each interrupt vector as a handler
+whenever the interrupt mask can be set.
+
+The resulting `Analysis` reports the maximum stack depth, whether the
+stack can grow into code, and which loaded bytes are never executed.
+`safe` is True when the analysis proves that, from this state on:
+
+* every jump, call and return goes to a known instruction
+* the stack pointer only moves by PUSH, POP, CALL, RET, interrupts and
+  IRET, with functions and handlers returning at the depth they started
+* no store can reach code, the stack or an interrupt vector
+* code ends below the lowest address the stack can reach
+
+For such a program the `pc < SP` asserts the fast engine makes after
+every instruction can never fail, and `CPU.run` leaves them out.
+"""
+
+from collections import deque
+
+from cpu import IM_REG, IS_REG, INTERRUPTS, KEY_BUFFER, MAX_MEM
+from cpu import NULL_INTERRUPT, SP_REG
+from opcodes import ALU, ALU_MASK, ALU_OP, OPCODES, REGISTERS
+
+NAMES = {**{code: func.__name__ for code, func in OPCODES.items()}, **ALU}
+
+VECTORS = MAX_MEM - INTERRUPTS
+FRAME = REGISTERS + 1  # bytes an interrupt pushes: PC, FL and R0-R6
+
+JUMPS = ('JEQ', 'JGE', 'JGT', 'JLE', 'JLT', 'JNE')
+
+
+class Analysis:
+    """What `analyze` found out about one program."""
+
+    def __init__(self, entry, sp):
+        self.entry = entry  # address the analysis started at
+        self.sp = sp  # stack pointer at the start
+        self.instructions = {}  # address -> (opcode, a, b, size)
+        self.edges = {}  # address -> successor addresses
+        self.functions = {}  # (kind, entry) -> stack depth, None if unbounded
+        self.handlers = set()  # interrupt handler addresses
+        self.max_depth = None  # stack bytes in use at most
+        self.unreachable = []  # loaded addresses never executed
+        self.problems = []  # why the program is not proven safe
+
+    @property
+    def safe(self):
+        return not self.problems
+
+    @property
+    def stack_low(self):
+        """Lowest address the stack can reach, None if unbounded."""
+        if self.max_depth is None:
+            return None
+        return self.sp - self.max_depth
+
+    def blocks(self):
+        """Return the basic blocks, `{entry: [addresses]}`."""
+        leaders = {self.entry} | self.handlers | {
+            entry for _, entry in self.functions}
+        for address, successors in self.edges.items():
+            after = address + self.instructions[address][3]
+            if successors != [after]:
+                leaders.update(successors)
+                leaders.add(after)
+        blocks = {}
+        for leader in sorted(leaders & set(self.instructions)):
+            block = blocks[leader] = [leader]
+            address = leader
+            while True:
+                successors = self.edges[address]
+                after = address + self.instructions[address][3]
+                if successors != [after] or after in leaders \
+                        or after not in self.instructions:
+                    break
+                address = after
+                block.append(address)
+        return blocks
+
+    def disassemble(self, address):
+        """Return one instruction as assembler text."""
+        ir, a, b, size = self.instructions[address]
+        name = NAMES[ir]
+        if size == 1:
+            return name
+        if size == 2:
+            return f'{name} R{a}'
+        if ir & ALU_MASK or name in ('LD', 'ST'):
+            return f'{name} R{a},R{b}'
+        return f'{name} R{a},{b}'
+
+    def report(self):
+        """Return the listing, CFG and findings as text."""
+        lines = []
+        for entry, block in self.blocks().items():
+            successors = self.edges[block[-1]]
+            lines.append(f'block {entry:#04x} -> '
+                         f'{", ".join(f"{s:#04x}" for s in successors)}')
+            for address in block:
+                lines.append(
+                    f'    {address:#04x}  {self.disassemble(address)}')
+        depth = 'unbounded' if self.max_depth is None else \
+            f'{self.max_depth} bytes, down to {self.stack_low:#04x}'
+        handlers = ', '.join(f'{h:#04x}' for h in sorted(self.handlers))
+        lines += [
+            '',
+            f'instructions: {len(self.instructions)}',
+            f'max stack depth: {depth}',
+            f'interrupt handlers: {handlers or "none"}',
+            f'unreachable bytes: {len(self.unreachable)}'
+            + (f' ({ranges(self.unreachable)})' if self.unreachable else ''),
+            f'proven safe: {"yes" if self.safe else "no"}',
+        ]
+        lines += [f'    {problem}' for problem in self.problems]
+        return '\n'.join(lines) + '\n'
+
+
+def ranges(addresses):
+    """Format sorted addresses as hex ranges."""
+    parts = []
+    start = end = addresses[0]
+    for address in addresses[1:] + [None]:
+        if address == end + 1:
+            end = address
+            continue
+        parts.append(f'{start:#04x}' if start == end
+                     else f'{start:#04x}-{end:#04x}')
+        start = end = address
+    return ', '.join(parts)
+
+
+def join(regs, other):
+    """Merge two register states, keeping the values they agree on."""
+    return tuple(x if x == y else None for x, y in zip(regs, other))
+
+
+def analyze(cpu):
+    """Analyze the 8-bit program in `cpu`, starting at its PC."""
+    ram = cpu.ram
+    sp = cpu.reg[SP_REG]
+    result = Analysis(cpu.PC, sp)
+    problems = result.problems
+
+    def problem(text):
+        if text not in problems:
+            problems.append(text)
+
+    states = {}  # (context, address) -> (registers, depth)
+    callers = {}  # context -> {(caller context, return address, depth)}
+    returns = {}  # context -> registers at its returns
+    depths = {}  # context -> deepest local stack depth
+    calls = {}  # context -> {(depth at call, callee context)}
+    stores = set()  # (address, value) of every ST, None where unknown
+    halts = set()  # PC values left behind by instructions that stop
+    work = deque()
+    interrupts = False
+
+    def visit(context, address, regs, depth):
+        if address >= MAX_MEM:
+            # an instruction that continues ends at the last byte
+            problem('execution runs past the end of memory')
+            return
+        key = (context, address)
+        old = states.get(key)
+        if old is None:
+            states[key] = (regs, depth)
+        elif old[1] != depth:
+            problem(f'stack depth at {address:#04x} is {old[1]} or {depth}')
+            return
+        else:
+            regs = join(old[0], regs)
+            if regs == old[0]:
+                return
+            states[key] = (regs, depth)
+        depths[context] = max(depths.get(context, 0), depth)
+        work.append(key)
+
+    def enable_interrupts():
+        # interrupts can now be dispatched: every vector is a handler
+        nonlocal interrupts
+        if interrupts:
+            return
+        interrupts = True
+        for i in range(INTERRUPTS):
+            add_handler(ram[VECTORS + i])
+        for address, value in stores:
+            if address is not None and address >= VECTORS and \
+                    value is not None:
+                add_handler(value)
+
+    def add_handler(address):
+        if address not in result.handlers:
+            result.handlers.add(address)
+            # handlers start with interrupts disabled, other registers
+            # hold whatever the interrupted code left in them
+            regs = [None] * REGISTERS
+            regs[IM_REG] = 0
+            visit(('int', address), address, tuple(regs), 0)
+
+    regs = list(cpu.reg)
+    regs[IS_REG] = regs[SP_REG] = None  # set by devices, tracked as depth
+    visit(('main', cpu.PC), cpu.PC, tuple(regs), 0)
+    if cpu.reg[IM_REG]:
+        enable_interrupts()
+
+    while work:
+        context, pc = key = work.popleft()
+        regs, depth = states[key]
+        kind = context[0]
+        ir = ram[pc]
+        if ir not in NAMES:
+            problem(f'invalid opcode {ir:08b} at {pc:#04x}')
+            continue
+        name = NAMES[ir]
+        size = 1 + (ir >> 6)
+        if pc + size > MAX_MEM:
+            problem(f'{name} at {pc:#04x} runs past the end of memory')
+            continue
+        a = ram[pc + 1] if size > 1 else None
+        b = ram[pc + 2] if size > 2 else None
+        if a is not None and a >= REGISTERS or b is not None and \
+                b >= REGISTERS and (ir & ALU_MASK or name in ('LD', 'ST')):
+            problem(f'{name} at {pc:#04x} has an invalid register')
+            continue
+        result.instructions[pc] = (ir, a, b, size)
+        successors = result.edges.setdefault(pc, [])
+        after = pc + size
+        regs = list(regs)
+        written = None  # register written with regs[written]
+
+        def target():
+            if regs[a] is None:
+                problem(f'{name} at {pc:#04x} jumps to an unknown address')
+            return regs[a]
+
+        if ir & ALU_MASK:
+            if name != 'CMP':
+                x, y = regs[a], regs[b] if size == 3 else 0
+                if name in ('DIV', 'MOD') and not y:
+                    halts.add(after)  # divide by zero halts
+                    if y == 0:
+                        continue
+                regs[a] = None if x is None or y is None else \
+                    ALU_OP[name](x, y) & (MAX_MEM - 1)
+                written = a
+        elif name == 'ADDI':
+            regs[a] = None if regs[a] is None else \
+                (regs[a] + b) & (MAX_MEM - 1)
+            written = a
+        elif name == 'LDI':
+            regs[a] = b
+            written = a
+        elif name == 'LD':
+            regs[a] = None
+            written = a
+        elif name == 'ST':
+            stores.add((regs[a], regs[b]))
+            if regs[a] is not None and VECTORS <= regs[a] and \
+                    regs[b] is not None and interrupts:
+                add_handler(regs[b])
+        elif name == 'PUSH':
+            depth += 1
+        elif name == 'POP':
+            if depth == 0:
+                problem(f'POP at {pc:#04x} takes a value it did not push')
+            depth -= 1
+            regs[a] = None
+            written = a
+        elif name == 'HLT':
+            halts.add(after)
+            continue
+        elif name == 'JMP':
+            address = target()
+            if address is not None:
+                successors.append(address)
+                visit(context, address, tuple(regs), depth)
+            continue
+        elif name in JUMPS:
+            address = target()
+            if address is not None:
+                successors.append(address)
+                visit(context, address, tuple(regs), depth)
+        elif name == 'CALL':
+            address = target()
+            if address is None:
+                continue
+            successors.append(address)
+            callee = ('call', address)
+            calls.setdefault(context, set()).add((depth + 1, callee))
+            callers.setdefault(callee, set()).add((context, after, depth))
+            visit(callee, address, tuple(regs), 0)
+            if callee in returns:
+                successors.append(after)
+                visit(context, after, returns[callee], depth)
+            continue
+        elif name == 'RET':
+            if depth or kind != 'call':
+                problem(f'RET at {pc:#04x} returns to an unknown address')
+                continue
+            regs = tuple(regs)
+            returns[context] = regs = join(returns.get(context, regs), regs)
+            for caller, address, caller_depth in callers[context]:
+                result.edges[address - 2].append(address)
+                visit(caller, address, regs, caller_depth)
+            continue
+        elif name == 'IRET':
+            if depth or kind != 'int':
+                problem(f'IRET at {pc:#04x} returns to an unknown address')
+            continue
+
+        if written == SP_REG:
+            problem(f'{name} at {pc:#04x} moves the stack pointer')
+            continue
+        if written == IS_REG:
+            regs[IS_REG] = None
+        if regs[IM_REG] != 0:
+            if written == IM_REG and kind != 'main':
+                problem(f'{name} at {pc:#04x} may enable nested interrupts')
+            enable_interrupts()
+        successors.append(after)
+        visit(context, after, tuple(regs), depth)
+
+    # stores to unknown addresses or vectors can change code or handlers
+    for address, value in stores:
+        if address is None:
+            problem('ST to an unknown address')
+        elif address >= VECTORS and interrupts and value is None:
+            problem(f'ST of an unknown handler to vector {address:#04x}')
+
+    # stack depth of each context, including what its calls push
+    totals = {}
+
+    def total(context, path=()):
+        if context in path:
+            problem(f'recursive call to {context[1]:#04x}')
+            return None
+        if context not in totals:
+            deepest = depths.get(context, 0)
+            for depth, callee in calls.get(context, ()):
+                inner = total(callee, path + (context,))
+                if inner is None:
+                    deepest = None
+                    break
+                deepest = max(deepest, depth + inner)
+            totals[context] = deepest
+        return totals[context]
+
+    for context in depths:
+        result.functions[context] = total(context)
+    main = total(('main', cpu.PC))
+    handler = [total(('int', address)) for address in result.handlers]
+    if main is not None and None not in handler:
+        result.max_depth = main + (
+            FRAME + max(handler) if handler else 0)
+
+    # code must stay below the lowest stack address and out of reach
+    code = set()
+    for address, (ir, a, b, size) in result.instructions.items():
+        code.update(range(address, address + size))
+    low = result.stack_low
+    if low is not None:
+        if low < 0:
+            problem('stack can wrap around memory')
+        for address, (ir, a, b, size) in result.instructions.items():
+            if address + size > low and address != NULL_INTERRUPT:
+                problem(f'code at {address:#04x} may overlap the stack')
+        for address in halts:
+            if address >= low and address != NULL_INTERRUPT:
+                problem(f'stops with PC {address:#04x} in the stack')
+        written = {address for address, _ in stores if address is not None}
+        written |= set(range(max(low, 0), sp)) | {KEY_BUFFER}
+        for address in sorted(written & code):
+            problem(f'code at {address:#04x} can be overwritten')
+
+    result.unreachable = [a for a in cpu.loaded if a not in code]
+    for successors in result.edges.values():
+        successors[:] = sorted(set(successors))
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    from cpu import CPU
+
+    if len(sys.argv) != 2:
+        print(f'python {sys.argv[0]} file_name.ls8')
+        sys.exit(1)
+    cpu = CPU()
+    cpu.load(sys.argv[1])
+    print(analyze(cpu).report(), end='')
@@ -0,0 +1,153 @@
+"""Run many LS-8 programs in parallel, headless.
+
+Each program runs on a fresh `CPU` in a worker process, with no terminal
+attached, under a cycle limit and a wall-clock timeout. One JSON object
+per program is written, in the order the programs were given:
+
+    {"program": "examples/mult.ls8", "reason": "HLT", "cycles": 8,
+     "seconds": 0.0001, "output": "72\\n", "error": null}
+
+`reason` is why the run stopped: "HLT", "limit", "timeout", or "fault"
+when the program could not be loaded or raised, or its worker process
+died, with the message in `error`.
+"""
+
+import io
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from glob import glob
+from time import perf_counter
+
+from cpu import CPU, ENGINES, FAULT, HALT
+from keyboard import Keyboard
+from output import Output
+
+USAGE = ('python ls8.py batch [--engine=checked|fast|jit] [--wide] '
+         '[--jobs=N] [--max-cycles=N] [--timeout=SECONDS] '
+         '[--output=FILE] program.ls8|glob ...')
+
+
+def run_program(filename, engine='fast', bits=8, max_cycles=10_000_000,
+                max_wall=10.0):
+    """Run one program on a fresh headless CPU, return its result dict."""
+    output = bytearray()
+    cpu = CPU(engine=engine, bits=bits, keyboard=Keyboard(io.StringIO()),
+              output=Output(output))
+    error = None
+    start = perf_counter()
+    try:
+        cpu.load(filename)
+        reason = cpu.run(max_cycles=max_cycles, max_wall=max_wall)
+    except Exception as ex:
+        reason = FAULT
+        error = f'{type(ex).__name__}: {ex}'
+    return {
+        'program': filename,
+        'reason': reason,
+        'cycles': cpu.cycles,
+        'seconds': round(perf_counter() - start, 6),
+        'output': output.decode(errors='replace'),
+        'error': error,
+    }
+
+
+def expand(patterns):
+    """Expand glob patterns, keeping plain names that match nothing."""
+    programs = []
+    for pattern in patterns:
+        programs += sorted(glob(pattern)) or [pattern]
+    return programs
+
+
+def failure(filename, ex):
+    """Return the result dict of a program whose worker failed."""
+    return {
+        'program': filename,
+        'reason': FAULT,
+        'cycles': 0,
+        'seconds': 0.0,
+        'output': '',
+        'error': f'{type(ex).__name__}: {ex}',
+    }
+
+
+def run_alone(run, filename):
+    """Run one program in a pool of its own, so a crash is its own."""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(run, filename).result()
+        except Exception as ex:
+            return failure(filename, ex)
+
+
+def run_batch(programs, out, jobs=None, **options):
+    """Run programs across `jobs` processes, write JSON lines to out.
+
+    A program whose worker raises or dies gets a "fault" result of its
+    own. When a worker dies, the pool is lost with the programs it was
+    running: the first of them is run again alone, to tell whether it
+    was the one that crashed, and the rest in a new pool.
+
+    Returns the number of programs that did not halt.
+    """
+    run = partial(run_program, **options)
+    failed = 0
+    pending = list(programs)
+    while pending:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run, filename) for filename in pending]
+            done = 0
+            for filename, future in zip(pending, futures):
+                broken = False
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    result = run_alone(run, filename)
+                    broken = True
+                except Exception as ex:
+                    result = failure(filename, ex)
+                failed += result['reason'] != HALT
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+                done += 1
+                if broken:
+                    break
+        pending = pending[done:]
+    return failed
+
+
+def main(argv):
+    """Parse batch arguments and run, return the exit status."""
+    args = [arg for arg in argv if not arg.startswith('--')]
+    flags = dict(
+        flag[2:].split('=', 1) if '=' in flag else (flag[2:], None)
+        for flag in argv if flag.startswith('--')
+    )
+    known = {'engine', 'wide', 'jobs', 'max-cycles', 'timeout', 'output'}
+    if not args or not set(flags) <= known \
+            or flags.get('engine', 'fast') not in ENGINES:
+        print(USAGE, file=sys.stderr)
+        return 2
+
+    options = {
+        'engine': flags.get('engine', 'fast'),
+        'bits': 16 if 'wide' in flags else 8,
+        'max_cycles': int(flags.get('max-cycles', 10_000_000)),
+        'max_wall': float(flags.get('timeout', 10.0)),
+    }
+    jobs = int(flags['jobs']) if flags.get('jobs') else None
+    programs = expand(args)
+
+    if flags.get('output'):
+        with open(flags['output'], 'w') as out:
+            failed = run_batch(programs, out, jobs, **options)
+    else:
+        failed = run_batch(programs, sys.stdout, jobs, **options)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
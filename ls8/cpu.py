@@ -1,12 +1,18 @@
 """CPU functionality."""
 
+from array import array
 from os import name
 from re import finditer, MULTILINE
+from struct import Struct
+from zlib import crc32
 from time import time
 
-from kbhit import KBHit
-from opcodes import ALU, ALU_MASK, ALU_OP, BITS
+from keyboard import ESC, Keyboard
+from opcodes import ALU, ALU_MASK, ALU_OPCODES, BITS, CMP_FLAGS
+from opcodes import TABLE_ALU, alu_table, table_alu_opcodes
 from opcodes import IRET_OPCODE, OPCODES, REGISTERS
+from output import Output
+from timer import WallTimer
 
 MAX_MEM = 1 << BITS
 
@@ -19,9 +25,41 @@ RESERVED = 3
 STACK_BASE = KEY_BUFFER = MAX_MEM - INTERRUPTS - RESERVED - 1
 NULL_INTERRUPT = MAX_MEM - INTERRUPTS - 1
 
+# 16-bit mode: 64 KiB of memory, two-byte interrupt vectors at the top
+WIDE_BITS = 16
+WIDE_MAX_MEM = 1 << WIDE_BITS
+WIDE_VECTORS = WIDE_MAX_MEM - 2 * INTERRUPTS
+WIDE_NULL_INTERRUPT = WIDE_VECTORS - 1
+WIDE_STACK_BASE = WIDE_KEY_BUFFER = WIDE_NULL_INTERRUPT - RESERVED
+
 TIMER_INTERRUPT = 0
 KEYBOARD_INTERRUPT = 1
 
+ENGINES = ('checked', 'fast', 'jit')
+
+# `CPU.snapshot` header: magic, version, word size, PC, IR, FL, saved IM,
+# cycles; followed by the registers and RAM. IR, FL and the saved IM are
+# words, the saved IM of a 16-bit CPU can exceed a byte
+SNAPSHOT = Struct('<4sBBHHHHxxQ')
+SNAPSHOT_MAGIC = b'LS8S'
+SNAPSHOT_VERSION = 2
+
+# binary image (.ls8b) header written by asm.py: magic, version, word
+# size, load address, entry point, code size, symbol table size, CRC-32
+# of code and symbol table; followed by the code and the symbol table,
+# entries of (address: 2 bytes, name length: 1 byte, name)
+IMAGE = Struct('<4sBBHHHHI')
+IMAGE_SYMBOL = Struct('<HB')
+IMAGE_MAGIC = b'LS8B'
+IMAGE_VERSION = 1
+
+# reasons `CPU.run` returns
+HALT = 'HLT'
+ESCAPE = 'ESC'
+LIMIT = 'limit'
+TIMEOUT = 'timeout'
+FAULT = 'fault'  # recorded by callers when the run raised
+
 
 def nested_property(func):
     """ Nest getter, setter and deleter
@@ -36,9 +74,81 @@ def nested_property(func):
 class CPU:
     """Main CPU class."""
 
-    def __init__(self):
-        """Construct a new CPU."""
+    def __init__(self, engine=None, bits=None, timer=None, keyboard=None,
+                 output=None, trace=None, tables=None):
+        """Construct a new CPU.
+
+        `engine` selects how `run` executes instructions: 'checked' (the
+        default) goes through the register properties and their asserts,
+        'fast' runs the unchecked handlers in `FAST_OPCODES` and 'jit'
+        compiles programs proven safe to a Python function (see jit.py).
+
+        `bits` is the word size: 8 (the default), or 16 for 16-bit
+        registers and addresses over 64 KiB of memory (see wide.py),
+        which runs on the fast engine.
+
+        `timer` raises the timer interrupt, by default a `WallTimer` that
+        fires about once a second; a `VirtualTimer` ticks every N cycles
+        for reproducible runs (see timer.py).
+
+        `keyboard` supplies keys for the keyboard interrupt, by default a
+        `Keyboard` reading stdin (see keyboard.py).
+
+        `output` receives PRA and PRN output, by default an `Output`
+        buffering to stdout (see output.py).
+
+        `trace` is the number of instructions to keep in `CPU.trace`, a
+        ring buffer dumped to stderr when the run faults (see tracer.py);
+        0, the default, records nothing.
+
+        `tables` runs MUL, DIV, MOD, SHL, SHR and CMP as lookups in
+        precomputed 64 KiB tables, built on first use (see opcodes.py);
+        8-bit mode only.
+        """
+        if getattr(self, '_stepping', False):
+            self.close()  # a reset releases the devices `step` holds
+        if engine is None:
+            engine = getattr(self, 'engine', 'checked')
+        if bits is None:
+            bits = getattr(self, 'bits', BITS)
+        if timer is None:
+            timer = getattr(self, 'timer', None) or WallTimer()
+        if keyboard is None:
+            keyboard = getattr(self, 'keyboard', None) or Keyboard()
+        if output is None:
+            output = getattr(self, 'output', None) or Output()
+        if trace is None:
+            trace = getattr(getattr(self, 'trace', None), 'depth', 0)
+        if tables is None:
+            tables = getattr(self, 'tables', False)
+        assert engine in ENGINES, f'unknown engine: {engine}'
+        assert bits in (BITS, WIDE_BITS), f'unsupported word size: {bits}'
+        assert bits == BITS or engine == 'fast', \
+            f'{bits}-bit mode runs on the fast engine'
+        assert bits == BITS or not tables, \
+            f'ALU tables need {BITS}-bit mode'
+        self.engine = engine
+        self.bits = bits
+        self.timer = timer
+        self.timer.reset()
+        self.keyboard = keyboard
+        self.output = output
+        if trace:
+            from tracer import Trace
+            self.trace = Trace(trace, bits)
+        else:
+            self.trace = None
+        self.tables = tables
+        self._alu_opcodes = table_alu_opcodes() if tables else ALU_OPCODES
+        self._fast_opcodes = fast_table_opcodes() if tables else FAST_OPCODES
+        self.cycles = 0  # instructions executed since reset
+        self._device_poll = 0  # cycle count the devices are due at
+        self.stop_reason = None  # why the last run stopped
+        self.fault = None  # exception that stopped `step`, if any
+        self.symbols = {}  # label -> address, from a binary image
+        self.loaded = range(0)  # addresses filled by the last load
         self._running = False
+        self._stepping = False  # devices started by `step`, until `close`
 
         del self.reg  # Set registers to 0
         del self.SP  # Set stack pointer to STACK_BASE
@@ -47,6 +157,19 @@ class CPU:
         del self.ram  # Set RAM to 0
 
         del self.IM, self.IS  # Set interrupt mask, state to 0
+        self._old_IM = 0  # interrupt mask saved while handling interrupt
+        # set by writes that may unmask or raise an interrupt, cleared by
+        # `check_interrupts` once none is pending
+        self._interrupts_pending = True
+
+        if bits == WIDE_BITS:
+            self.reg[SP_REG] = WIDE_STACK_BASE
+            self.ram[WIDE_NULL_INTERRUPT] = IRET_OPCODE
+            for i in range(INTERRUPTS):  # little-endian vectors
+                vector = WIDE_VECTORS + 2 * i
+                self.ram[vector:vector + 2] = \
+                    WIDE_NULL_INTERRUPT.to_bytes(2, 'little')
+            return
 
         # initialize NULL_INTERUPT to IRET_OPCODE
         self.ram_write(NULL_INTERRUPT, IRET_OPCODE)
@@ -57,22 +180,27 @@ class CPU:
     ###  GENERAL PURPOSE RGISTERS  #######################################
     @nested_property
     def reg():
-        """General Purpose Registers"""
+        """General Purpose Registers, one word each"""
 
         def fget(self):
             try:
                 return self._reg
             except:
-                self._reg = [0] * REGISTERS
+                if self.bits == BITS:
+                    self._reg = bytearray(REGISTERS)
+                else:
+                    self._reg = array('H', bytes(2 * REGISTERS))
                 return self._reg
 
         def fset(self, value):
             assert isinstance(value, int), \
                 'reg.fset: value must be int'
-            self._reg = [value & (MAX_MEM - 1)] * REGISTERS
+            reg = self.reg
+            for i in range(REGISTERS):
+                reg[i] = value & ((1 << self.bits) - 1)
 
         def fdel(self):
-            self._reg = [0] * REGISTERS
+            self.reg = 0
         return locals()
 
     @nested_property
@@ -83,10 +211,12 @@ class CPU:
             return self.reg[IM_REG]
 
         def fset(self, value):
-            self.reg[IM_REG] = value & (MAX_MEM - 1)
+            self.reg[IM_REG] = value
+            self._interrupts_pending = True
 
         def fdel(self):
             self.reg[IM_REG] = 0
+            self._interrupts_pending = True
         return locals()
 
     @nested_property
@@ -97,10 +227,12 @@ class CPU:
             return self.reg[IS_REG]
 
         def fset(self, value):
-            self.reg[IS_REG] = value & (MAX_MEM - 1)
+            self.reg[IS_REG] = value
+            self._interrupts_pending = True
 
         def fdel(self):
             self.reg[IS_REG] = 0
+            self._interrupts_pending = True
         return locals()
 
     @nested_property
@@ -157,7 +289,6 @@ class CPU:
                 return self._instruction_register
 
         def fset(self, value):
-            value = value & (MAX_MEM - 1)
             assert value in OPCODES or value in ALU, \
                 f'CPU.IR: invalid opcode: {value:08b} at: {self.PC}'
             self._instruction_register = value
@@ -212,7 +343,6 @@ class CPU:
                 return self._memory_data_register
 
         def fset(self, value):
-            value = value & (MAX_MEM - 1)
             self._memory_data_register = value
 
         def fdel(self):
@@ -250,8 +380,6 @@ class CPU:
                 return self._operand_a
 
         def fset(self, value):
-            if value is not None:
-                value = value & (MAX_MEM - 1)
             assert value is None or 0 <= value < REGISTERS, \
                 f'operand_a out of range: {value}'
             self._operand_a = value
@@ -272,8 +400,6 @@ class CPU:
                 return self._operand_b
 
         def fset(self, value):
-            if value is not None:
-                value = value & (MAX_MEM - 1)
             assert value is None or (
                 value < (REGISTERS if self.IR & ALU_MASK else MAX_MEM)
             ), f'operand_b out of range for ALU operation: {value}'
@@ -286,24 +412,90 @@ class CPU:
     ###  MEMORY  #########################################################
     @nested_property
     def ram():
-        """Memory"""
+        """Memory, one byte per address
+
+        Resets fill the same buffer in place, so views of it stay valid;
+        they also empty the code caches.
+        """
 
         def fget(self):
             try:
                 return self._ram
             except:
-                self._ram = [0] * MAX_MEM
+                self._ram = bytearray(1 << self.bits)
+                self._reset_code_caches()
                 return self._ram
 
         def fset(self, value):
             assert isinstance(value, int), \
                 f'ram.fset: value must be int'
-            self._ram = [value & (MAX_MEM - 1)] * MAX_MEM
+            self.ram[:] = bytes([value & 0xFF]) * len(self.ram)
+            self._reset_code_caches()
 
         def fdel(self):
-            self._ram = [0] * MAX_MEM
+            self.ram = 0
         return locals()
 
+    @property
+    def memory(self):
+        """Read-only view of RAM, for inspecting memory without copying."""
+        return memoryview(self.ram).toreadonly()
+
+    def snapshot(self):
+        """Return the machine state as a compact binary blob.
+
+        Holds RAM, the registers (so IM, IS and pending interrupts), PC,
+        IR, FL, the IM saved by the last interrupt and the cycle count.
+        16-bit registers are stored in native byte order. Devices (timer,
+        keyboard, output) are not part of the snapshot.
+        """
+        registers = memoryview(self.reg).cast('B')
+        blob = bytearray(SNAPSHOT.size + len(registers) + len(self.ram))
+        SNAPSHOT.pack_into(
+            blob, 0, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.bits, self.PC,
+            self.IR, self.FL, self._old_IM, self.cycles)
+        end = SNAPSHOT.size + len(registers)
+        blob[SNAPSHOT.size:end] = registers
+        blob[end:] = self.ram
+        return bytes(blob)
+
+    def restore(self, blob):
+        """Restore the machine state from a `snapshot` blob."""
+        view = memoryview(blob)
+        magic, version, bits, pc, ir, fl, old_im, cycles = \
+            SNAPSHOT.unpack_from(view)
+        registers = memoryview(self.reg).cast('B')
+        end = SNAPSHOT.size + len(registers)
+        assert magic == SNAPSHOT_MAGIC and version == SNAPSHOT_VERSION, \
+            'not an LS-8 snapshot'
+        assert bits == self.bits and len(view) == end + len(self.ram), \
+            f'snapshot is for a {bits}-bit CPU'
+        registers[:] = view[SNAPSHOT.size:end]
+        self.ram[:] = view[end:]
+        self._program_counter = pc
+        self._instruction_register = ir
+        self._flags = fl
+        self._old_IM = old_im
+        self.cycles = cycles
+        self.timer.resume(cycles)
+        self._device_poll = min(self.timer.next_poll(cycles),
+                                cycles + self.keyboard.poll_cycles)
+        self._running = False
+        self.stop_reason = self.fault = None
+        self._reset_code_caches()
+
+    def _reset_code_caches(self):
+        """Empty the decoded instruction, superinstruction and compiled
+        program caches.
+        """
+        size = len(self._ram)
+        self._decoded = [None] * size  # address -> fast_decode entry
+        self._fused = [None] * size  # address -> fast_fuse entry
+        self._covers = [[] for _ in range(size)]  # address -> entries
+        # (cycles, PC, RAM, registers, analysis) where a proof holds
+        self._proof = None
+        self._compiled = None  # (analysis, jit program, block entries)
+
     def ram_read(self, address):
         self.MAR = address
         self.MDR = self.ram[self.MAR]
@@ -312,125 +504,904 @@ class CPU:
     def ram_write(self, address, value):
         self.MAR, self.MDR = address, value
         self.ram[self.MAR] = self.MDR
+        invalidate(self._decoded, self._fused, self._covers, self.MAR)
 
     ###  CPU OPERATIONS  #################################################
     def load(self, filename):
-        """Load a program into memory."""
+        """Load a program into memory.
+
+        Reads `.ls8` text, or a binary `.ls8b` image, which is read
+        straight into RAM at its load address; its entry point becomes
+        the PC and its labels `CPU.symbols`.
+        """
         # reset state
         self.__init__()
 
-        """Load a program into memory."""
-        with open(filename, 'r') as f:
-            program = f.read()
+        with open(filename, 'rb') as f:
+            header = bytearray(IMAGE.size)
+            read = f.readinto(header)
+            if header.startswith(IMAGE_MAGIC):
+                assert read == IMAGE.size, 'truncated image'
+                return self._load_image(f, header)
 
-        for address, match in enumerate(
-            finditer(r'^[01]{8}', program, MULTILINE)
-        ):
-            assert address < STACK_BASE, \
-                'program too large to fit in memory'
-            instruction = match.group()
-            self.ram_write(address, int(instruction, 2))
+        # undecodable bytes become U+FFFD, binary junk is not a program
+        with open(filename, 'r', errors='replace') as f:
+            program = f.read()
+        assert '\ufffd' not in program, 'not an LS-8 program'
+
+        code = bytes(
+            int(match.group(), 2)
+            for match in finditer(r'^[01]{8}', program, MULTILINE)
+        )
+        stack_base = STACK_BASE if self.bits == BITS else WIDE_STACK_BASE
+        assert len(code) <= stack_base, \
+            'program too large to fit in memory'
+        self.ram[:len(code)] = code
+        self.loaded = range(len(code))
+
+    def _load_image(self, f, header):
+        """Load a binary image whose header was read from f."""
+        magic, version, bits, load, entry, size, symbols_size, checksum = \
+            IMAGE.unpack(header)
+        assert version == IMAGE_VERSION, \
+            f'unsupported image version: {version}'
+        assert bits == self.bits, f'image is for a {bits}-bit CPU'
+        stack_base = STACK_BASE if self.bits == BITS else WIDE_STACK_BASE
+        assert load + size <= stack_base, \
+            'program too large to fit in memory'
+        code = memoryview(self.ram)[load:load + size]
+        symbols = bytearray(symbols_size)
+        assert f.readinto(code) == size and \
+            f.readinto(symbols) == symbols_size, 'truncated image'
+        assert crc32(symbols, crc32(code)) == checksum, 'image checksum error'
+        offset = 0
+        while offset < symbols_size:
+            address, length = IMAGE_SYMBOL.unpack_from(symbols, offset)
+            offset += IMAGE_SYMBOL.size
+            self.symbols[symbols[offset:offset + length].decode()] = address
+            offset += length
+        self._program_counter = entry
+        self.loaded = range(load, load + size)
 
     def alu(self, op, reg_a, reg_b):
-        """ALU operations."""
+        """ALU operations, `op` is the ALU opcode."""
+
+        handler = self._alu_opcodes[op]
+        if handler is None:
+            raise SystemError(
+                f'Unsupported ALU operation: {op:08b} at {self.PC}')
+        handler(self, self.reg, reg_a, reg_b)
+        if reg_a == IM_REG or reg_a == IS_REG:
+            self._interrupts_pending = True
+
+    def interrupt(self, interrupt):
+        """Sets N bit in IS register."""
+        assert interrupt < INTERRUPTS, \
+            f'invalid interrupt: {interrupt}'
+        self.IS |= (1 << interrupt)
+
+    def run(self, max_cycles=None, max_wall=None):
+        """Run the CPU.
+
+        Stops after `max_cycles` instructions or `max_wall` seconds when
+        given; returns why it stopped, one of HALT, ESCAPE, LIMIT or
+        TIMEOUT. Faults raise. A run stopped by LIMIT or TIMEOUT can be
+        continued by calling `run` (or `step`) again.
+        """
+        self.start_devices(max_cycles, max_wall)
+        if self.trace is not None and self.engine != 'checked':
+            # the trace needs every instruction, not compiled blocks
+            from tracer import run_traced
+            return run_traced(self)
+        if self.engine == 'fast':
+            return self._run_fast()
+        if self.engine == 'jit':
+            from jit import run_jit
+            return run_jit(self)
 
+        self._running = True
+        self._interrupts_pending = True  # registers may have been set
+        next_poll = self.cycles
+        trace = self.trace
         try:
-            x = self.reg[reg_a]
-            y = self.reg[reg_b] if reg_b is not None else None
-            result = ALU_OP[op](x, y)
-            if op == 'CMP':
-                self.FL = result
-            else:
-                self.reg[reg_a] = result
-                self.reg[reg_a] &= (MAX_MEM - 1)
-        except ZeroDivisionError:
-            print(f'ALU ERROR: {op} by 0 at {self.PC}')
-            self.__running__ = False
+            while self._running:
+                # trigger timer and keyboard interrupts, stop when asked to
+                if self.cycles >= next_poll:
+                    next_poll = self.poll_devices(
+                        self.cycles, self.ram_write, KEY_BUFFER)
+                    if next_poll is None:
+                        break
+
+                if self._interrupts_pending:
+                    self.check_interrupts()
+
+                if trace is not None:
+                    pc, ram = self.PC, self.ram
+                    trace.record(pc, ram[pc], ram[(pc + 1) & (MAX_MEM - 1)],
+                                 ram[(pc + 2) & (MAX_MEM - 1)], self.FL,
+                                 self.reg)
+
+                # process instruction at program counter
+                self.IR = self.ram_read(self.PC)
+                if self.IR & ALU_MASK:
+                    self.alu(self.IR, self.OP_A, self.OP_B)
+                else:
+                    OPCODES[self.IR](self)
+
+                # adjust program counter if necessary
+                if not self.IR & 0b10000:
+                    self.PC += (1 + (self.IR >> 6))
+                self.cycles += 1
         except Exception:
-            raise SystemError(f'Unsupported ALU operation: {op} at {self.PC}')
+            if trace is not None:
+                self.output.flush()  # keep program output before the dump
+                trace.dump()
+            raise
+        finally:
+            self.stop_devices()
+        return self.stop_reason
+
+    def step(self, n=1, max_wall=None):
+        """Run at most `n` more instructions, return a status.
+
+        Each call continues where the last one stopped, and devices are
+        polled at the same cycles as in one long run, so with a
+        `VirtualTimer` any split of the same total gives the same result.
+        Returns LIMIT while the program is still running, HALT once it
+        has halted, ESCAPE, TIMEOUT after `max_wall` seconds, or FAULT
+        when an instruction raised, with the exception in `fault`. After
+        HALT or FAULT, further calls return the same without running.
+        The devices are started by the first call and stay started until
+        the program stops or `close` is called.
+        """
+        if self.stop_reason == FAULT or (
+                self.stop_reason == HALT and not self._running):
+            return self.stop_reason
+        if not self._stepping:
+            # started once, not per slice: starting the keyboard resets
+            # the terminal and drops keys typed since
+            self.timer.start()
+            self.keyboard.start()
+            self._stepping = True
+        try:
+            status = self.run(max_cycles=n, max_wall=max_wall)
+        except Exception as ex:
+            self.fault = ex
+            self.stop_reason = status = FAULT
+        if status not in (LIMIT, TIMEOUT):
+            self.close()
+        return status
+
+    def close(self):
+        """Flush the output and release the keyboard held by `step`.
+
+        `step` keeps the devices started between calls and closes them
+        when the program halts, faults or is stopped with ESC; call this
+        to stop stepping earlier.
+        """
+        self._stepping = False
+        self.stop_devices()
 
-    def trace(self):
+    def profile(self, max_cycles=None, max_wall=None):
+        """Run the CPU like `run`, counting opcodes, addresses and calls.
+
+        Runs on the fast engine handlers and returns a `Profile` (see
+        profiler.py), with the stop reason in `Profile.reason`.
+        """
+        from profiler import run_profiled
+        self.start_devices(max_cycles, max_wall)
+        return run_profiled(self)
+
+    def start_devices(self, max_cycles, max_wall):
+        """Start the timer and keyboard, unless `step` holds them, and
+        the run budget.
         """
-        Handy function to print out the CPU state. You might want to call this
-        from run() if you need help debugging.
+        if not self._stepping:
+            self.timer.start()
+            self.keyboard.start()
+        self.stop_reason = HALT
+        self.cycle_limit = \
+            None if max_cycles is None else self.cycles + max_cycles
+        self.deadline = None if max_wall is None else time() + max_wall
+
+    def stop_devices(self):
+        """Flush the output and release the keyboard, unless `step`
+        holds them.
         """
+        if not self._stepping:
+            self.output.flush()
+            self.keyboard.stop()
 
-        print(f"TRACE: %02X | %02X %02X %02X |" % (
-            self.PC,
-            # self.FL,
-            # self.ie,
-            self.ram_read(self.PC),
-            self.ram_read(self.PC + 1),
-            self.ram_read(self.PC + 2)
-        ), end='')
+    def poll_devices(self, cycles, write, key_buffer):
+        """Raise timer and keyboard interrupts that are due.
 
-        for i in range(REGISTERS):
-            print(" %02X" % self.reg[i], end='')
+        A key is stored with `write` at `key_buffer`. Returns the cycle
+        count to poll at next, or None when the run should stop, with
+        the reason in `stop_reason`. A run resuming before the devices
+        are due only checks its budget.
+        """
+        if self.cycle_limit is not None and cycles >= self.cycle_limit:
+            self.stop_reason = LIMIT
+            return None
+        if self.deadline is not None and time() >= self.deadline:
+            self.stop_reason = TIMEOUT
+            return None
+        if cycles < self._device_poll:
+            next_poll = self._device_poll
+            if self.cycle_limit is not None:
+                next_poll = min(next_poll, self.cycle_limit)
+            return next_poll
+        self.output.poll()
+        if self.timer.poll(cycles):
+            self.reg[IS_REG] |= (1 << TIMER_INTERRUPT)
+            self._interrupts_pending = True
+        key = self.keyboard.getkey()
+        if key == ESC:
+            self.stop_reason = ESCAPE
+            return None
+        if key is not None:
+            write(key_buffer, key)
+            self.reg[IS_REG] |= (1 << KEYBOARD_INTERRUPT)
+            self._interrupts_pending = True
+        next_poll = self._device_poll = min(
+            self.timer.next_poll(cycles), cycles + self.keyboard.poll_cycles)
+        if self.cycle_limit is not None:
+            next_poll = min(next_poll, self.cycle_limit)
+        return next_poll
 
-        print()
+    def check_interrupts(self):
+        """Checks and handles pending interupts.
 
-    def interrupt(self, interrupt):
-        """Sets N bit in IS register."""
-        assert interrupt < INTERRUPTS, \
-            f'invalid interrupt: {interrupt}'
-        self.IS |= (1 << interrupt)
+        Run while `_interrupts_pending` is set; clears it when no
+        unmasked interrupt is pending.
+        """
+        maskedInterrupts = self.IM & self.IS
+        if not maskedInterrupts:
+            self._interrupts_pending = False
+            return
+        bit = maskedInterrupts & -maskedInterrupts  # lowest triggered
+        interrupt = bit.bit_length() - 1
+        self._old_IM = self.IM  # save interrupt state
+        self.IM = 0  # disable interrupts
+        self.IS &= (255 ^ bit)  # clear interrupt
+        self.SP -= 1  # push program counter
+        self.ram_write(self.SP, self.PC)
+        self.SP -= 1  # push flags
+        self.ram_write(self.SP, self.FL)
+        for i in range(REGISTERS-1):  # push R0-R6
+            self.SP -= 1
+            self.ram_write(self.SP, self.reg[i])
+        self.PC = self.ram[MAX_MEM - INTERRUPTS +
+                           interrupt]  # PC <- handler
+
+    def _fast_setup(self):
+        """Return the fast engine state and helpers for the word size.
+
+        `(state, decode, interrupt, mask, null_interrupt, key_buffer)`
+        """
+        if self.bits == BITS:
+            return (FastState(self), fast_decode, fast_interrupt,
+                    MAX_MEM - 1, NULL_INTERRUPT, KEY_BUFFER)
+        from wide import WideState, wide_decode, wide_interrupt
+        return (WideState(self), wide_decode, wide_interrupt,
+                WIDE_MAX_MEM - 1, WIDE_NULL_INTERRUPT, WIDE_KEY_BUFFER)
+
+    def _prove(self):
+        """Return the `Analysis` proving the program safe from its current
+        state on (see analyze.py), or None.
+
+        The proof is kept with the state it holds for, and runs store the
+        state they stop in with it: a run that continues where the last
+        one stopped, with memory and registers untouched since, keeps it.
+        """
+        if self.bits != BITS:  # 16-bit programs are never proven
+            return None
+        state = (self.cycles, self.PC, bytes(self.ram), bytes(self.reg))
+        if self._proof is None or self._proof[:4] != state:
+            from analyze import analyze
+            analysis = analyze(self)
+            self._proof = state + (analysis if analysis.safe else None,)
+        return self._proof[4]
+
+    def _run_fast(self):
+        """Run the CPU without the register properties.
+
+        Machine state lives in locals and a `FastState`; invariants are
+        asserted only where an instruction can break them, with the same
+        messages the checked engine uses. Programs proven safe run common
+        instruction pairs as superinstructions (see `fast_fuse`).
+        """
+        # programs proven to keep code below the stack skip the
+        # per-instruction program counter asserts
+        proof = self._prove()
+        proven = proof is not None
+        m, decode, interrupt, mask, null_interrupt, key_buffer = \
+            self._fast_setup()
+        reg, decoded = m.reg, m.decoded
+        pc, ir = self.PC, self.IR
+        cycles = self.cycles
+        next_poll = cycles
+        m.running = True
+        try:
+            if not proven:
+                while m.running:
+                    # trigger timer and keyboard interrupts, stop if asked to
+                    if cycles >= next_poll:
+                        next_poll = self.poll_devices(
+                            cycles, m.write, key_buffer)
+                        if next_poll is None:
+                            break
+                        m.pending = True
+
+                    # dispatch the lowest pending interrupt, if any
+                    if m.pending:
+                        if reg[IM_REG] & reg[IS_REG]:
+                            pc = interrupt(m, pc, ir)
+                        else:
+                            m.pending = False
+
+                    # decode instruction at program counter, once each
+                    entry = decoded[pc] or decode(m, pc)
+                    ir, handler, a, b, size = entry
+                    assert size == 1 or pc + size <= reg[SP_REG], \
+                        f'CPU.IR: instruction operands in stack at: {pc}'
+
+                    # execute, handlers return the next program counter
+                    pc = handler(m, pc, a, b) & mask
+                    assert pc < reg[SP_REG] or pc == null_interrupt, \
+                        f'invalid program counter: {pc}, ' \
+                        f'stack: {reg[SP_REG]}'
+                    cycles += 1
+            else:
+                # pairs run up to the cycle before the next poll, so
+                # devices are polled at the same cycles as unfused
+                fused = m.fused
+                fuse_until = next_poll - 1
+                while m.running:
+                    if cycles >= fuse_until:
+                        if cycles >= next_poll:
+                            next_poll = self.poll_devices(
+                                cycles, m.write, key_buffer)
+                            if next_poll is None:
+                                break
+                            fuse_until = next_poll - 1
+                            m.pending = True
+
+                        if cycles >= fuse_until:
+                            if m.pending:
+                                if reg[IM_REG] & reg[IS_REG]:
+                                    pc = interrupt(m, pc, ir)
+                                else:
+                                    m.pending = False
+
+                            ir, handler, a, b, size = \
+                                decoded[pc] or decode(m, pc)
+                            pc = handler(m, pc, a, b) & mask
+                            cycles += 1
+                            continue
+
+                    if m.pending:
+                        if reg[IM_REG] & reg[IS_REG]:
+                            pc = interrupt(m, pc, ir)
+                        else:
+                            m.pending = False
+
+                    ir, handler, a, b, count = fused[pc] or fast_fuse(m, pc)
+                    pc = handler(m, pc, a, b) & mask
+                    cycles += count
+        finally:
+            self.cycles = cycles
+            self._running = m.running
+            self._program_counter = pc
+            self._instruction_register = ir
+            self._flags = m.fl
+            self._old_IM = m.old_im
+            if self.bits == BITS:  # 16-bit runs are never proven
+                self._proof = (cycles, pc, bytes(m.ram), bytes(m.reg), proof)
+            self.stop_devices()
+        return self.stop_reason
+
+
+###  FAST ENGINE  ####################################################
+class FastState:
+    """Machine state shared by the fast engine handlers.
+
+    `ram`, `reg` and the code caches are the CPU's own objects, so writes
+    are visible to the CPU immediately; the remaining fields are copied
+    back when the run loop exits.
+    """
+    __slots__ = ('ram', 'reg', 'decoded', 'fused', 'covers', 'output', 'fl',
+                 'old_im', 'running', 'pending', 'handlers', 'tables')
+
+    def __init__(self, cpu):
+        self.ram = cpu.ram
+        self.reg = cpu.reg
+        self.decoded = cpu._decoded
+        self.fused = cpu._fused
+        self.covers = cpu._covers
+        self.output = cpu.output
+        self.fl = cpu.FL
+        self.old_im = cpu._old_IM
+        self.running = cpu._running
+        self.pending = True  # registers may have been set since
+        self.handlers = cpu._fast_opcodes
+        self.tables = cpu.tables
+
+    def write(self, address, value):
+        """Store value at address, dropping cached code covering it."""
+        self.ram[address] = value
+        decoded = self.decoded
+        decoded[address] = decoded[address - 1] = decoded[address - 2] = None
+        if self.covers[address]:
+            invalidate(decoded, self.fused, self.covers, address)
+
+
+# opcode to unchecked implementation map, keyed like `OPCODES`
+# filled with `@fast_opcode('NAME')` decorator
+FAST_OPCODES = {}
+_OPCODE_NAMES = {func.__name__: code for code, func in OPCODES.items()}
+
+
+def fast_opcode(name):
+    """Decorator to build FAST_OPCODES table."""
+    def _(func):
+        return FAST_OPCODES.setdefault(_OPCODE_NAMES[name], func)
+    return _
+
+
+# opcodes that write register a
+WRITES_A = {code for code, cmd in ALU.items() if cmd != 'CMP'} | {
+    _OPCODE_NAMES[name] for name in ('ADDI', 'LD', 'LDI', 'POP')
+}
+
+
+def flag_pending(handler):
+    """Wrap a handler that writes IM or IS to set `FastState.pending`."""
+    def flagged(m, pc, a, b):
+        m.pending = True
+        return handler(m, pc, a, b)
+    return flagged
+
+
+def fast_decode(m, pc):
+    """Decode and validate the instruction at pc, caching the result.
+
+    Entries are `(opcode, handler, operand_a, operand_b, size)` and stay
+    valid until one of the instruction's bytes is written.
+    """
+    ram, reg = m.ram, m.reg
+    ir = ram[pc]
+    handler = m.handlers.get(ir)
+    assert handler is not None, \
+        f'CPU.IR: invalid opcode: {ir:08b} at: {pc}'
+    if ir & (1 << BITS - 2):  # one operand
+        assert pc + 1 < reg[SP_REG], \
+            f'CPU.IR: instruction operands in stack at: {pc}'
+        a, b, size = ram[pc + 1], None, 2
+        assert a < REGISTERS, f'operand_a out of range: {a}'
+    elif ir & (1 << BITS - 1):  # two operands
+        assert pc + 2 < reg[SP_REG], \
+            f'CPU.IR: instruction operands in stack at: {pc}'
+        a, b, size = ram[pc + 1], ram[pc + 2], 3
+        assert a < REGISTERS, f'operand_a out of range: {a}'
+        assert b < REGISTERS or not ir & ALU_MASK, \
+            f'operand_b out of range for ALU operation: {b}'
+    else:  # zero operands
+        a, b, size = None, None, 1
+    if (a == IM_REG or a == IS_REG) and ir in WRITES_A:
+        handler = flag_pending(handler)
+    entry = m.decoded[pc] = (ir, handler, a, b, size)
+    return entry
+
+
+def invalidate(decoded, fused, covers, address):
+    """Drop decoded instructions and superinstructions covering address."""
+    decoded[address] = decoded[address - 1] = decoded[address - 2] = None
+    for entry in covers[address]:
+        fused[entry] = None
+    covers[address].clear()
+
+
+def push_sp(reg, last):
+    """Decrement SP, asserting what `CPU.SP.fset` would.
+
+    `last` is the address of the last byte of the executing instruction.
+    """
+    sp = (reg[SP_REG] - 1) & (MAX_MEM - 1)
+    assert sp <= STACK_BASE, 'stack pointer out of range'
+    assert last < sp or last == NULL_INTERRUPT, \
+        'stack cannot overlap executing code'
+    reg[SP_REG] = sp
+    return sp
 
-    def run(self):
-        """Run the CPU."""
-        self._running = True
-        old_time = time()
-        kb = KBHit()
-        while self._running:
-            # trigger timer interrupt every second (approx)
-            new_time = time()
-            if new_time - old_time > 1:
-                self.interrupt(TIMER_INTERRUPT)
-                old_time = new_time
-
-            # trigger keyboard interrupt on keypress
-            if kb.kbhit():
-                c = kb.getch()
-                if ord(c[0]) == 27:  # ESC
-                    self._running = False
-                    break
-                self.ram_write(KEY_BUFFER, ord(c[0]))
-                self.interrupt(KEYBOARD_INTERRUPT)
-
-            self.check_interrupts()
-
-            # process instruction at program counter
-            self.IR = self.ram_read(self.PC)
-            if self.IR & ALU_MASK:
-                self.alu(ALU[self.IR], self.OP_A, self.OP_B)
+
+def pop_sp(reg, last):
+    """Increment SP, asserting what `CPU.SP.fset` would."""
+    sp = (reg[SP_REG] + 1) & (MAX_MEM - 1)
+    assert sp <= STACK_BASE, 'stack pointer out of range'
+    assert last < sp or last == NULL_INTERRUPT, \
+        'stack cannot overlap executing code'
+    reg[SP_REG] = sp
+    return sp
+
+
+def fast_interrupt(m, pc, ir):
+    """Dispatch the lowest pending interrupt, return the handler address.
+
+    `ir` is the last executed opcode, used for the stack overlap check.
+    """
+    ram, reg = m.ram, m.reg
+    pending = reg[IM_REG] & reg[IS_REG]
+    interrupt = (pending & -pending).bit_length() - 1  # lowest set bit
+    m.old_im = reg[IM_REG]  # save interrupt state
+    reg[IM_REG] = 0  # disable interrupts
+    reg[IS_REG] &= (MAX_MEM - 1) ^ (1 << interrupt)  # clear interrupt
+    last = pc + (ir >> 6)
+    m.write(push_sp(reg, last), pc)  # push program counter
+    m.write(push_sp(reg, last), m.fl)  # push flags
+    for i in range(REGISTERS - 1):  # push R0-R6
+        m.write(push_sp(reg, last), reg[i])
+    pc = ram[MAX_MEM - INTERRUPTS + interrupt]  # PC <- handler
+    assert pc < reg[SP_REG] or pc == NULL_INTERRUPT, \
+        f'invalid program counter: {pc}, stack: {reg[SP_REG]}'
+    return pc
+
+
+def fast_alu(code, cmd):
+    """Build the unchecked handler for an ALU opcode."""
+    size = 1 + (code >> 6)
+
+    if cmd == 'CMP':
+        def handler(m, pc, a, b):
+            reg = m.reg
+            x, y = reg[a], reg[b]
+            m.fl = CMP_FLAGS[(x > y) - (x < y) + 1]
+            return pc + size
+    elif cmd in ('DIV', 'MOD'):
+        alu = ALU_OPCODES[code]
+
+        def handler(m, pc, a, b):
+            reg = m.reg
+            if reg[b]:
+                alu(m, reg, a, b)
             else:
-                OPCODES[self.IR](self)
+                m.output.text(f'ALU ERROR: {cmd} by 0 at {pc}\n')
+                m.running = False
+            return pc + size
+    else:
+        # the remaining handlers only touch the register file
+        alu = ALU_OPCODES[code]
+
+        def handler(m, pc, a, b):
+            alu(m, m.reg, a, b)
+            return pc + size
+    return handler
+
+
+for _code, _cmd in ALU.items():
+    FAST_OPCODES[_code] = fast_alu(_code, _cmd)
+
+# `FAST_OPCODES` with lookup table ALU handlers where they exist,
+# filled on first use by `fast_table_opcodes`
+FAST_TABLE_OPCODES = {}
+
+
+def table_fast_alu(code, cmd):
+    """Build the unchecked handler for an ALU opcode with a lookup table."""
+    table = alu_table(cmd)
+    size = 1 + (code >> 6)
+
+    if cmd == 'CMP':
+        def handler(m, pc, a, b):
+            reg = m.reg
+            m.fl = table[reg[a] << BITS | reg[b]]
+            return pc + size
+    elif cmd in ('DIV', 'MOD'):
+        by_zero = FAST_OPCODES[code]
+
+        def handler(m, pc, a, b):
+            reg = m.reg
+            if reg[b]:
+                reg[a] = table[reg[a] << BITS | reg[b]]
+                return pc + size
+            return by_zero(m, pc, a, b)
+    else:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            reg[a] = table[reg[a] << BITS | reg[b]]
+            return pc + size
+    return handler
+
+
+def fast_table_opcodes():
+    """Return `FAST_OPCODES` with lookup table handlers where they exist,
+    building the tables on the first call.
+    """
+    if not FAST_TABLE_OPCODES:
+        FAST_TABLE_OPCODES.update(FAST_OPCODES)
+        for code, cmd in ALU.items():
+            if cmd in TABLE_ALU:
+                FAST_TABLE_OPCODES[code] = table_fast_alu(code, cmd)
+    return FAST_TABLE_OPCODES
 
-            # adjust program counter if necessary
-            if not self.IR & 0b10000:
-                self.PC += (1 + (self.IR >> 6))
 
-        kb.set_normal_term()
+@fast_opcode('ADDI')
+def fast_addi(m, pc, a, b):
+    m.reg[a] = (m.reg[a] + b) & (MAX_MEM - 1)
+    return pc + 3
+
+
+@fast_opcode('CALL')
+def fast_call(m, pc, a, b):
+    reg = m.reg
+    m.write(push_sp(reg, pc + 1), (pc + 2) & (MAX_MEM - 1))
+    return reg[a]
 
-    def check_interrupts(self):
-        """Checks and handles pending interupts."""
-        maskedInterrupts = self.IM & self.IS
-        for interrupt in range(8):
-            bit = 1 << interrupt
-            if maskedInterrupts & bit:  # if interrupt is triggered
-                self._old_IM = self.IM  # save interrupt state
-                self.IM = 0  # disable interrupts
-                self.IS &= (255 ^ bit)  # clear interrupt
-                self.SP -= 1  # push program counter
-                self.ram_write(self.SP, self.PC)
-                self.SP -= 1  # push flags
-                self.ram_write(self.SP, self.FL)
-                for i in range(REGISTERS-1):  # push R0-R6
-                    self.SP -= 1
-                    self.ram_write(self.SP, self.reg[i])
-                self.PC = self.ram[MAX_MEM - INTERRUPTS +
-                                   interrupt]  # PC <- handler
-                break  # stop checking interrupts
 
+@fast_opcode('HLT')
+def fast_hlt(m, pc, a, b):
+    m.running = False
+    return pc + 1
+
+
+@fast_opcode('INT')
+def fast_int(m, pc, a, b):
+    reg = m.reg
+    assert reg[a] < BITS, f'invalid interrupt: {reg[a]}'
+    reg[IS_REG] |= (1 << reg[a])
+    m.pending = True
+    return pc + 2
+
+
+@fast_opcode('IRET')
+def fast_iret(m, pc, a, b):
+    ram, reg = m.ram, m.reg
+    for i in range(6, -1, -1):  # pop R6-R0
+        reg[i] = ram[reg[SP_REG]]
+        pop_sp(reg, pc)
+    m.fl = ram[reg[SP_REG]]  # pop flags
+    pop_sp(reg, pc)
+    pc = ram[reg[SP_REG]]  # pop program counter
+    assert pc < reg[SP_REG] or pc == NULL_INTERRUPT, \
+        f'invalid program counter: {pc}, stack: {reg[SP_REG]}'
+    pop_sp(reg, pc)
+    reg[IM_REG] = m.old_im  # restore interrupt mask
+    m.pending = True
+    return pc
+
+
+@fast_opcode('JEQ')
+def fast_jeq(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b1 else pc + 2
+
+
+@fast_opcode('JGE')
+def fast_jge(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b11 else pc + 2
+
+
+@fast_opcode('JGT')
+def fast_jgt(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b10 else pc + 2
+
+
+@fast_opcode('JLE')
+def fast_jle(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b101 else pc + 2
+
+
+@fast_opcode('JLT')
+def fast_jlt(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b100 else pc + 2
+
+
+@fast_opcode('JMP')
+def fast_jmp(m, pc, a, b):
+    return m.reg[a]
+
+
+@fast_opcode('JNE')
+def fast_jne(m, pc, a, b):
+    return pc + 2 if m.fl & 0b1 else m.reg[a]
+
+
+@fast_opcode('LD')
+def fast_ld(m, pc, a, b):
+    reg = m.reg
+    assert b < REGISTERS, f'invalid register: {b}'
+    reg[a] = m.ram[reg[b]]
+    return pc + 3
+
+
+@fast_opcode('LDI')
+def fast_ldi(m, pc, a, b):
+    m.reg[a] = b
+    return pc + 3
+
+
+@fast_opcode('NOP')
+def fast_nop(m, pc, a, b):
+    return pc + 1
+
+
+@fast_opcode('POP')
+def fast_pop(m, pc, a, b):
+    reg = m.reg
+    reg[a] = m.ram[reg[SP_REG]]
+    pop_sp(reg, pc + 1)
+    return pc + 2
+
+
+@fast_opcode('PRA')
+def fast_pra(m, pc, a, b):
+    m.output.char(m.reg[a])
+    return pc + 2
+
+
+@fast_opcode('PRN')
+def fast_prn(m, pc, a, b):
+    m.output.number(m.reg[a])
+    return pc + 2
+
+
+@fast_opcode('PUSH')
+def fast_push(m, pc, a, b):
+    reg = m.reg
+    sp = push_sp(reg, pc + 1)
+    m.write(sp, reg[a])  # after the push, PUSH R7 stores the new SP
+    return pc + 2
+
+
+@fast_opcode('RET')
+def fast_ret(m, pc, a, b):
+    reg = m.reg
+    pc = m.ram[reg[SP_REG]]
+    assert pc < reg[SP_REG] or pc == NULL_INTERRUPT, \
+        f'invalid program counter: {pc}, stack: {reg[SP_REG]}'
+    pop_sp(reg, pc)
+    return pc
+
+
+@fast_opcode('ST')
+def fast_st(m, pc, a, b):
+    reg = m.reg
+    assert b < REGISTERS, f'invalid register: {b}'
+    m.write(reg[a], reg[b])
+    return pc + 3
+
+
+###  SUPERINSTRUCTIONS  ##############################################
+# jump opcode -> FL bits it jumps on, None for JMP; JNE jumps on clear
+JUMP_FLAGS = {
+    _OPCODE_NAMES[name]: bits for name, bits in (
+        ('JMP', None), ('JEQ', 0b1), ('JGE', 0b11), ('JGT', 0b10),
+        ('JLE', 0b101), ('JLT', 0b100), ('JNE', 0b1),
+    )
+}
+JNE_OPCODE = _OPCODE_NAMES['JNE']
+CALL_OPCODE = _OPCODE_NAMES['CALL']
+CMP_OPCODE = {cmd: code for code, cmd in ALU.items()}['CMP']
+
+
+def fuse_ldi(ir, y):
+    """Build the handler for LDI followed by a jump or CALL on Ry."""
+    if ir == CALL_OPCODE:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            reg[a] = b
+            m.write(push_sp(reg, pc + 4), (pc + 5) & (MAX_MEM - 1))
+            return reg[y]
+        return handler
+
+    bits = JUMP_FLAGS[ir]
+    if bits is None:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            reg[a] = b
+            return reg[y]
+    elif ir == JNE_OPCODE:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            reg[a] = b
+            return pc + 5 if m.fl & bits else reg[y]
+    else:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            reg[a] = b
+            return reg[y] if m.fl & bits else pc + 5
+    return handler
+
+
+def fuse_cmp(ir, y):
+    """Build the handler for CMP followed by a jump on Ry."""
+    bits = JUMP_FLAGS[ir]
+    if bits is None:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            x, z = reg[a], reg[b]
+            m.fl = CMP_FLAGS[(x > z) - (x < z) + 1]
+            return reg[y]
+    elif ir == JNE_OPCODE:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            x, z = reg[a], reg[b]
+            m.fl = fl = CMP_FLAGS[(x > z) - (x < z) + 1]
+            return pc + 5 if fl & bits else reg[y]
+    else:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            x, z = reg[a], reg[b]
+            m.fl = fl = CMP_FLAGS[(x > z) - (x < z) + 1]
+            return reg[y] if fl & bits else pc + 5
+    return handler
+
+
+def fuse_stack(first, second):
+    """Build the handler for a PUSH or POP followed by a stack opcode."""
+    size, ir, a, b = first[4], second[0], second[2], second[3]
+    run_first, run_second = FAST_OPCODES[first[0]], FAST_OPCODES[ir]
+
+    def handler(m, pc, a_first, b_first):
+        return run_second(m, run_first(m, pc, a_first, b_first), a, b)
+    return handler
+
+
+# first opcode -> second opcode -> handler builder, called with both
+# decoded entries
+FUSIONS = {
+    _OPCODE_NAMES['LDI']: {
+        ir: lambda first, second: fuse_ldi(second[0], second[2])
+        for ir in (*JUMP_FLAGS, CALL_OPCODE)
+    },
+    CMP_OPCODE: {
+        ir: lambda first, second: fuse_cmp(second[0], second[2])
+        for ir in JUMP_FLAGS
+    },
+    _OPCODE_NAMES['PUSH']: {
+        _OPCODE_NAMES[name]: fuse_stack for name in ('CALL', 'PUSH')
+    },
+    _OPCODE_NAMES['POP']: {
+        _OPCODE_NAMES[name]: fuse_stack for name in ('POP', 'RET')
+    },
+}
+
+
+def fast_fuse(m, pc):
+    """Return the superinstruction entry at pc, caching it.
+
+    Entries are `(opcode, handler, operand_a, operand_b, count)`. When
+    the instruction at pc and the next one are a pair in `FUSIONS`, the
+    handler runs both, the opcode is the second one's and count is 2;
+    otherwise it is the decoded entry with a count of 1. Either way the
+    entry is dropped when any of its bytes is written.
+
+    Only used on programs `analyze` proved safe. LDI and POP only pair
+    when they do not write IM, IS or SP, so nothing between the two
+    instructions can raise an interrupt, and pairs stop before a device
+    poll, so registers, flags, memory and cycle counts are the same as
+    running them one at a time.
+    """
+    ir, handler, a, b, size = first = m.decoded[pc] or fast_decode(m, pc)
+    entry = (ir, handler, a, b, 1)
+    end = pc + size
+    pairs = FUSIONS.get(ir)
+    if pairs is not None and end + 1 < MAX_MEM and m.ram[end] in pairs \
+            and (ir not in WRITES_A or a < IM_REG):
+        try:
+            second = m.decoded[end] or fast_decode(m, end)
+        except AssertionError:
+            # leave invalid code to fault when it runs, if it does
+            second = None
+        if second is not None and \
+                (second[0] not in WRITES_A or second[2] < IM_REG):
+            handler = pairs[second[0]](first, second)
+            entry = (second[0], handler, a, b, 2)
+            end += second[4]
+    m.fused[pc] = entry
+    covers = m.covers
+    for address in range(pc, end):
+        covers[address].append(pc)
+    return entry
 
 if __name__ == '__main__':
     from os.path import dirname, join, realpath
@@ -0,0 +1,407 @@
+"""Compilation of proven LS-8 programs to one Python function.
+
+A program `analyze` proves safe can not overwrite its code, and every
+jump, call and return goes to a known instruction (see analyze.py). Once
+such a program has run `COMPILE_AFTER` instructions, all its basic
+blocks are compiled into one function that keeps the registers and FL
+in locals, and goes from block to block through a dispatch on the
+program counter without returning. A block that jumps back to its own
+start loops in place, and one that does nothing else is skipped ahead
+to the end of its budget.
+
+The function runs whole blocks within a budget that ends at the next
+device poll, and returns there, at HLT, after a write to IM or IS, and
+before INT and IRET. The run loop executes those, and the instructions
+up to the poll that do not make up a whole block, on the fast engine
+handlers, so devices are polled and interrupts dispatched at the same
+cycles as on the fast engine. Programs not proven safe, and runs until
+they are hot, use the fast engine.
+"""
+
+from cpu import FastState, fast_decode, fast_fuse, fast_interrupt
+from cpu import IM_REG, IS_REG, KEY_BUFFER, MAX_MEM, WRITES_A
+from cpu import NULL_INTERRUPT, STACK_BASE
+from opcodes import ALU, ALU_MASK, OPCODES, REGISTERS, TABLE_ALU, alu_table
+
+COMPILE_AFTER = 4096  # instructions a program runs before it is compiled
+
+NAMES = {**{code: func.__name__ for code, func in OPCODES.items()}, **ALU}
+
+# opcodes left to the fast handlers, which raise and return from
+# interrupts
+HANDLED = {code for code, name in NAMES.items() if name in ('INT', 'IRET')}
+
+# opcodes after which the program counter is not the next instruction's
+TRANSFERS = {
+    code for code, name in NAMES.items() if name in (
+        'CALL', 'HLT', 'JEQ', 'JGE', 'JGT', 'JLE', 'JLT', 'JMP', 'JNE', 'RET',
+    )
+}
+
+ALU_EXPR = {  # ALU command to Python expression, masked to a byte
+    'ADD': '({x} + {y}) & {mask}',
+    'AND': '{x} & {y}',
+    'DEC': '({x} - 1) & {mask}',
+    'INC': '({x} + 1) & {mask}',
+    'MUL': '({x} * {y}) & {mask}',
+    'NOT': '~{x} & {mask}',
+    'OR': '{x} | {y}',
+    'SHL': '({x} << {y}) & {mask}',
+    'SHR': '{x} >> {y}',
+    'SUB': '({x} - {y}) & {mask}',
+    'XOR': '{x} ^ {y}',
+}
+
+JUMP_TEST = {  # conditional jump to flag test
+    'JEQ': 'fl & 0b1', 'JGE': 'fl & 0b11', 'JGT': 'fl & 0b10',
+    'JLE': 'fl & 0b101', 'JLT': 'fl & 0b100', 'JNE': 'not fl & 0b1',
+}
+
+REGS = ', '.join(f'r{i}' for i in range(REGISTERS))
+
+
+def writes_flags(ir, a):
+    """Return True if the instruction writes IM or IS."""
+    return ir in WRITES_A and (a == IM_REG or a == IS_REG)
+
+
+def block_starts(analysis):
+    """Return the sorted addresses compiled blocks start at.
+
+    These are the starts of the analysis' blocks and the instructions
+    the run loop hands back at: after INT and IRET, which are not
+    compiled, and after writes to IM or IS.
+    """
+    instructions = analysis.instructions
+    starts = set(analysis.blocks())
+    for address, (ir, a, b, size) in instructions.items():
+        if ir in HANDLED or writes_flags(ir, a):
+            starts.add(address + size)
+    return sorted(address for address in starts if address in instructions
+                  and instructions[address][0] not in HANDLED)
+
+
+def scan(analysis, starts, pc):
+    """Return the block at pc as `(address, opcode, a, b, size)` tuples.
+
+    A block ends at a transfer or a write to IM or IS, and before the
+    next block, INT and IRET.
+    """
+    instructions = analysis.instructions
+    block = []
+    while True:
+        ir, a, b, size = instructions[pc]
+        block.append((pc, ir, a, b, size))
+        if ir in TRANSFERS or writes_flags(ir, a):
+            return block
+        pc += size
+        if pc in starts or pc not in instructions or \
+                instructions[pc][0] in HANDLED:
+            return block
+
+
+def translate(pc, ir, a, b, size, rest, tables=False):
+    """Return Python source lines for one instruction.
+
+    Transfers leave the next program counter in `pc`; `rest` is the
+    number of block instructions after this one, which a halt by zero
+    gives back to the budget. With `tables`, ALU commands that have a
+    lookup table read it as the global `<command>_TABLE` (see
+    `opcodes.alu_table`).
+    """
+    name = NAMES[ir]
+    mask = MAX_MEM - 1
+    x, y = f'r{a}', f'r{b}'
+    lookup = f'{name}_TABLE[{x} << 8 | {y}]'
+    tables = tables and name in TABLE_ALU
+    lines = [f'# {pc:3}: {name}']
+
+    def sp_assert(last):
+        lines.append(f"assert sp <= {STACK_BASE}, "
+                     f"'stack pointer out of range'")
+        if last != NULL_INTERRUPT:
+            lines.append(f"assert {last} < sp, "
+                         f"'stack cannot overlap executing code'")
+
+    if ir & ALU_MASK:
+        if name == 'CMP':
+            lines.append(f'fl = {lookup}' if tables else
+                         f'fl = 1 if {x} == {y} else 2 if {x} > {y} else 4')
+        elif name in ('DIV', 'MOD'):
+            op = '//' if name == 'DIV' else '%'
+            value = lookup if tables else f'{x} {op} {y}'
+            # by zero: report it and halt, like the fast handler
+            error = f'ALU ERROR: {name} by 0 at {pc}\n'
+            lines += [f'if {y}:', f'    {x} = {value}', 'else:',
+                      f'    output.text({error!r})',
+                      '    m.running = False', f'    budget += {rest}',
+                      f'    ir = {ir}', f'    pc = {pc + size}', '    break']
+        elif tables:
+            lines.append(f'{x} = {lookup}')
+        else:
+            expr = ALU_EXPR[name].format(x=x, y=y, mask=mask)
+            lines.append(f'{x} = {expr}')
+    elif name == 'ADDI':
+        lines.append(f'{x} = ({x} + {b}) & {mask}')
+    elif name == 'LD':
+        lines.append(f'{x} = ram[{y}]')
+    elif name == 'LDI':
+        lines.append(f'{x} = {b}')
+    elif name == 'POP':
+        lines.append(f'{x} = ram[r7]')
+        lines.append(f'sp = (r7 + 1) & {mask}')
+        sp_assert(pc + 1)
+        lines.append('r7 = sp')
+    elif name == 'PRA':
+        lines.append(f'output.char({x})')
+    elif name == 'PRN':
+        lines.append(f'output.number({x})')
+    elif name == 'PUSH':
+        lines.append(f'sp = (r7 - 1) & {mask}')
+        sp_assert(pc + 1)
+        lines.append('r7 = sp')
+        lines.append(f'write(sp, {x})')  # PUSH R7 stores the new SP
+    elif name == 'ST':
+        lines.append(f'write({x}, {y})')
+    elif name == 'CALL':
+        lines.append(f'sp = (r7 - 1) & {mask}')
+        sp_assert(pc + 1)
+        lines.append('r7 = sp')
+        lines.append(f'write(sp, {(pc + 2) & mask})')
+        lines.append(f'pc = {x}')
+    elif name == 'RET':
+        lines.append('pc = ram[r7]')
+        lines.append(f'sp = (r7 + 1) & {mask}')
+        lines.append(f"assert sp <= {STACK_BASE}, "
+                     f"'stack pointer out of range'")
+        lines.append(f"assert pc < sp or pc == {NULL_INTERRUPT}, "
+                     f"'stack cannot overlap executing code'")
+        lines.append('r7 = sp')
+    elif name == 'HLT':
+        lines += ['m.running = False', f'pc = {pc + 1}']
+    elif name == 'JMP':
+        lines.append(f'pc = {x}')
+    elif name in JUMP_TEST:
+        lines.append(f'pc = {x} if {JUMP_TEST[name]} else {pc + 2}')
+    if writes_flags(ir, a):
+        lines += ['m.pending = True', f'pc = {pc + size}']
+    return lines
+
+
+def compile_block(block, loops, tables=False):
+    """Return the source lines of one block, each with the index of the
+    instruction it belongs to.
+
+    The lines run the block if the budget holds all of it, and continue
+    the dispatch loop at the next program counter, or break out of it.
+    With `loops`, a block that jumps back to its start loops in place.
+    """
+    entry, size = block[0][0], len(block)
+    last_pc, last_ir, last_a, _, last_size = block[-1]
+    name = NAMES[last_ir]
+    lines = []
+
+    def add(index, indent, source):
+        lines.extend((index, indent + line) for line in source)
+
+    if loops and name in ('JMP', *JUMP_TEST) and not any(
+            NAMES[ir] in ('DIV', 'MOD') for _, ir, _, _, _ in block):
+        # a loop: `continue` repeats the block, `break` leaves it for the
+        # dispatch, and an exhausted budget returns
+        body = [instruction for instruction in block
+                if NAMES[instruction[1]] != 'NOP']
+        if len(body) == 1 and name == 'JMP':
+            # waits for an interrupt: run it out to the budget
+            add(None, '', [f'if budget >= {size} and r{last_a} == {entry}:',
+                           f'    budget %= {size}', f'    ir = {last_ir}'])
+        add(None, '', [f'while budget >= {size}:', f'    budget -= {size}'])
+        for index, (pc, ir, a, b, length) in enumerate(block[:-1]):
+            add(index, '    ', translate(pc, ir, a, b, length, 0, tables))
+        if name == 'JMP':
+            jump = [f'ir = {last_ir}', f'pc = r{last_a}',
+                    f'if pc != {entry}:', '    break']
+        else:
+            jump = [f'ir = {last_ir}', f'if {JUMP_TEST[name]}:',
+                    f'    pc = r{last_a}', f'    if pc == {entry}:',
+                    '        continue', 'else:',
+                    f'    pc = {last_pc + last_size}', 'break']
+        add(size - 1, '    ', [f'# {last_pc:3}: {name}'] + jump)
+        add(None, '', ['else:', '    break', 'continue'])
+        return lines
+
+    add(None, '', [f'if budget < {size}:', '    break',
+                   f'budget -= {size}'])
+    for index, (pc, ir, a, b, length) in enumerate(block):
+        add(index, '', translate(pc, ir, a, b, length, size - 1 - index,
+                                 tables))
+    end = [f'ir = {last_ir}']
+    if name == 'HLT' or writes_flags(last_ir, last_a):
+        end.append('break')
+    else:
+        if last_ir not in TRANSFERS:
+            end.append(f'pc = {last_pc + last_size}')
+        end.append('continue')
+    add(size - 1, '', end)
+    return lines
+
+
+def dispatch(blocks, entries, indent, out):
+    """Add a binary search on pc over entries, running their blocks."""
+    if len(entries) <= 2:
+        for entry in entries:
+            out(None, indent + f'if pc == {entry}:')
+            for index, line in blocks[entry]:
+                out(None if index is None else (entry, index),
+                    indent + '    ' + line)
+        return
+    middle = len(entries) // 2
+    out(None, indent + f'if pc < {entries[middle]}:')
+    dispatch(blocks, entries[:middle], indent + '    ', out)
+    out(None, indent + 'else:')
+    dispatch(blocks, entries[middle:], indent + '    ', out)
+
+
+def compile_program(m, analysis):
+    """Compile the blocks of a proven program into one function.
+
+    Returns `(function, entries)`, where `entries` are the addresses
+    blocks start at. The function is called as `function(m, pc, budget,
+    ir)` and returns the same three values as they are when it stopped.
+    `function.lines` maps the source lines of each instruction to its
+    `(address, index in its block, block length)`.
+    """
+    starts = block_starts(analysis)
+    blocks, scanned = {}, {}
+    for pc in starts:
+        scanned[pc] = block = scan(analysis, set(starts), pc)
+        blocks[pc] = compile_block(block, pc in analysis.edges.get(
+            block[-1][0], ()), m.tables)
+
+    source = [
+        'def program(m, pc, budget, ir):',
+        '    reg, ram, write, output = m.reg, m.ram, m.write, m.output',
+        f'    {REGS} = reg',
+        '    fl = m.fl',
+        '    while True:',
+    ]
+    lines = {}
+
+    def out(where, line):
+        if where is not None:
+            entry, index = where
+            block = scanned[entry]
+            lines[len(source) + 1] = (block[index][0], index, len(block))
+        source.append(line)
+
+    dispatch(blocks, starts, '        ', out)
+    source += [
+        '        break',
+        f'    reg[:] = {REGS}',
+        '    m.fl = fl',
+        '    return pc, budget, ir',
+    ]
+
+    namespace = {}
+    if m.tables:
+        namespace.update(
+            (f'{name}_TABLE', alu_table(name)) for name in TABLE_ALU)
+    exec(compile('\n'.join(source) + '\n', '<ls8 program>', 'exec'),
+         namespace)
+    function = namespace['program']
+    function.source = '\n'.join(source)
+    function.lines = lines
+    return function, frozenset(starts)
+
+
+def fault_state(program, traceback, m):
+    """Store the registers and FL an exception left in a program call.
+
+    Returns `(pc, budget, ir)` at the instruction that raised, with the
+    budget of the instructions before it; outside any instruction, the
+    values the function held.
+    """
+    while traceback.tb_frame.f_code is not program.__code__:
+        traceback = traceback.tb_next
+    state = traceback.tb_frame.f_locals
+    if 'fl' not in state:  # raised before it read the registers
+        return state['pc'], state['budget'], state['ir']
+    m.reg[:] = bytes(state[f'r{i}'] for i in range(REGISTERS))
+    m.fl = state['fl']
+    where = program.lines.get(traceback.tb_lineno)
+    if where is None:
+        return state['pc'], state['budget'], state['ir']
+    address, index, size = where
+    return address, state['budget'] + size - index, m.ram[address]
+
+
+def run_jit(cpu):
+    """Run the CPU, compiling a proven program once it is hot, return
+    why it stopped.
+
+    On an exception the CPU stops at the instruction that raised, with
+    the cycles, registers and flags of the instructions before it.
+    """
+    analysis = cpu._prove()
+    if analysis is None:
+        return cpu._run_fast()
+    m = FastState(cpu)
+    reg, decoded, fused = m.reg, m.decoded, m.fused
+    mask = MAX_MEM - 1
+    program, entries = None, ()
+    if cpu._compiled is not None and cpu._compiled[0] is analysis:
+        program, entries = cpu._compiled[1:]
+    pc, ir = cpu.PC, cpu.IR
+    cycles = cpu.cycles
+    next_poll = cycles
+    m.running = True
+    try:
+        while m.running:
+            # trigger timer and keyboard interrupts, stop when asked to
+            if cycles >= next_poll:
+                next_poll = cpu.poll_devices(cycles, m.write, KEY_BUFFER)
+                if next_poll is None:
+                    break
+                m.pending = True
+                if program is None and cycles >= COMPILE_AFTER:
+                    program, entries = compile_program(m, analysis)
+                    cpu._compiled = (analysis, program, entries)
+
+            if m.pending:
+                if reg[IM_REG] & reg[IS_REG]:
+                    pc = fast_interrupt(m, pc, ir)
+                else:
+                    m.pending = False
+
+            # whole blocks up to the next poll in the compiled program
+            if pc in entries:
+                budget = next_poll - cycles
+                try:
+                    pc, left, ir = program(m, pc, budget, ir)
+                except BaseException as error:
+                    pc, left, ir = fault_state(
+                        program, error.__traceback__, m)
+                    cycles += budget - left
+                    raise
+                if left != budget:
+                    cycles += budget - left
+                    continue
+
+            # the rest on the fast handlers, in pairs up to the cycle
+            # before the poll (see `fast_fuse`)
+            if cycles < next_poll - 1:
+                ir, handler, a, b, count = fused[pc] or fast_fuse(m, pc)
+            else:
+                ir, handler, a, b, _ = decoded[pc] or fast_decode(m, pc)
+                count = 1
+            pc = handler(m, pc, a, b) & mask
+            cycles += count
+    finally:
+        cpu.cycles = cycles
+        cpu._running = m.running
+        cpu._program_counter = pc
+        cpu._instruction_register = ir
+        cpu._flags = m.fl
+        cpu._old_IM = m.old_im
+        cpu._proof = (cycles, pc, bytes(m.ram), bytes(m.reg), analysis)
+        cpu.stop_devices()
+    return cpu.stop_reason
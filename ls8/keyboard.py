@@ -0,0 +1,115 @@
+"""Keyboard input device.
+
+A reader thread per input stream pushes key codes into a queue, and the
+run loops take at most one key from it every `poll_cycles` instructions,
+so there is no system call per instruction.
+
+When the stream is a terminal it is switched to unbuffered, no-echo mode
+while the CPU runs. Any other stream (a pipe, a file, an `io.StringIO`)
+is read as it is, so the emulator runs headless under pipes and in CI.
+"""
+
+import os
+import sys
+from atexit import register
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+
+# Windows
+if os.name == 'nt':
+    import msvcrt
+
+# Posix (Linux, OS X)
+else:
+    import termios
+
+ESC = 27
+
+_readers = {}  # stream -> queue of key codes
+_readers_lock = Lock()
+
+
+def _read_terminal(keys):
+    """Read key codes from the console until it closes."""
+    if os.name == 'nt':
+        while True:
+            keys.put(ord(msvcrt.getwch()) & 0xFF)
+    else:
+        fd = sys.stdin.fileno()
+        while True:
+            c = os.read(fd, 1)
+            if not c:
+                return
+            keys.put(c[0])
+
+
+def _read_stream(stream, keys):
+    """Read key codes from a text or binary stream until EOF."""
+    while True:
+        c = stream.read(1)
+        if not c:
+            return
+        keys.put(c[0] if isinstance(c, bytes) else ord(c) & 0xFF)
+
+
+def reader(stream, terminal):
+    """Return the key queue for stream, starting its reader once.
+
+    Readers are shared, since two threads reading the same stream would
+    steal each other's keys.
+    """
+    with _readers_lock:
+        if stream not in _readers:
+            keys = _readers[stream] = SimpleQueue()
+            if terminal:
+                thread = Thread(target=_read_terminal, args=(keys,))
+            else:
+                thread = Thread(target=_read_stream, args=(stream, keys))
+            thread.daemon = True
+            thread.start()
+        return _readers[stream]
+
+
+class Keyboard:
+    """Keyboard input read from `stream`, by default stdin."""
+
+    def __init__(self, stream=None, poll_cycles=1024):
+        self.stream = sys.stdin if stream is None else stream
+        self.poll_cycles = poll_cycles
+        self.keys = None
+        self.old_term = None
+        self.registered = False
+
+    def is_terminal(self):
+        try:
+            return self.stream is sys.stdin and self.stream.isatty()
+        except ValueError:  # closed stream
+            return False
+
+    def start(self):
+        """Start reading, switching a terminal to unbuffered mode."""
+        terminal = self.is_terminal()
+        if terminal and os.name != 'nt' and self.old_term is None:
+            fd = self.stream.fileno()
+            self.old_term = termios.tcgetattr(fd)
+            new_term = termios.tcgetattr(fd)
+            new_term[3] = new_term[3] & ~termios.ICANON & ~termios.ECHO
+            termios.tcsetattr(fd, termios.TCSAFLUSH, new_term)
+            if not self.registered:  # Support normal-terminal reset at exit
+                register(self.stop)
+                self.registered = True
+        self.keys = reader(self.stream, terminal)
+
+    def stop(self):
+        """Restore the terminal, keys keep queueing for the next run."""
+        if self.old_term is not None:
+            termios.tcsetattr(self.stream.fileno(), termios.TCSAFLUSH,
+                              self.old_term)
+            self.old_term = None
+
+    def getkey(self):
+        """Return the next key code, or None if no key is waiting."""
+        try:
+            return self.keys.get_nowait()
+        except Empty:
+            return None
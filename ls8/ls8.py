@@ -6,9 +6,43 @@ from os.path import realpath, exists
 from cpu import CPU
 
 
-if len(sys.argv) == 2 and exists(realpath(sys.argv[1])):
-    cpu = CPU()
-    cpu.load(realpath(sys.argv[1]))
-    cpu.run()
-else:
-    print(f'python {sys.argv[0]} file_name.ls8')
+def main(argv):
+    args = [arg for arg in argv[1:] if not arg.startswith('--')]
+    flags = [arg for arg in argv[1:] if arg.startswith('--')]
+
+    engines = [flag[2:] for flag in flags if flag in ('--fast', '--jit')]
+    wide = '--wide' in flags
+    tables = '--tables' in flags
+    profile = [flag for flag in flags if flag.split('=')[0] == '--profile']
+    trace = [flag for flag in flags if flag.split('=')[0] == '--trace']
+
+    if argv[1:2] == ['batch']:
+        import batch
+        return batch.main(argv[2:])
+    elif len(args) == 1 and exists(realpath(args[0])) and len(engines) <= 1 \
+            and set(flags) - set(profile) - set(trace) \
+            <= {'--fast', '--jit', '--wide', '--tables'}:
+        engine = engines[0] if engines else 'fast' if wide else 'checked'
+        depth = int(trace[0].partition('=')[2] or 64) if trace else 0
+        cpu = CPU(engine=engine, bits=16 if wide else 8, trace=depth,
+                  tables=tables)
+        cpu.load(realpath(args[0]))
+        if profile:
+            # text report to stderr, collapsed stacks for flamegraphs to file
+            stacks = profile[0].partition('=')[2] or \
+                realpath(args[0]).rsplit('.', 1)[0] + '.folded'
+            result = cpu.profile()
+            print(result.report(), file=sys.stderr, end='')
+            with open(stacks, 'w') as f:
+                f.write(result.collapsed())
+            print(f'collapsed stacks written to {stacks}', file=sys.stderr)
+        else:
+            cpu.run()
+    else:
+        print(f'python {argv[0]} [--fast | --jit] [--wide | --tables] '
+              f'[--profile[=stacks.folded]] [--trace[=depth]] file_name.ls8')
+        print(f'python {argv[0]} batch --help')
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -14,6 +14,14 @@ ALU = {  # ALU opcode to command map
     0b10100001: 'SUB', 0b10101011: 'XOR',
 }
 
+MASK = (1 << BITS) - 1
+
+# IM and IS, writes to which may unmask or raise an interrupt
+INTERRUPT_REGISTERS = (REGISTERS - 3, REGISTERS - 2)
+
+# CMP flags, indexed by `(x > y) - (x < y) + 1`: less, equal, greater
+CMP_FLAGS = (0b100, 0b001, 0b010)
+
 ALU_OP = {  # ALU command to operation map
     'ADD': lambda x, y: x + y,
     'AND': lambda x, y: x & y,
@@ -46,6 +54,13 @@ def opcode(code):
     return _
 
 
+def set_reg_a(cpu, value):
+    """Store value in registerA, noting writes to IM and IS."""
+    cpu.reg[cpu.OP_A] = value
+    if cpu.OP_A in INTERRUPT_REGISTERS:
+        cpu._interrupts_pending = True
+
+
 @opcode(0b01010000)
 def CALL(cpu):
     """Calls a subroutine at the address stored in the register."""
@@ -161,13 +176,13 @@ def LD(cpu):
     """
     assert cpu.OP_B >= 0 and cpu.OP_B < len(cpu.reg), \
         f'invalid register: {cpu.OP_B}'
-    cpu.reg[cpu.OP_A] = cpu.ram_read(cpu.reg[cpu.OP_B])
+    set_reg_a(cpu, cpu.ram_read(cpu.reg[cpu.OP_B]))
 
 
 @opcode(0b10000010)
 def LDI(cpu):
     """Set the value of a register to an integer."""
-    cpu.reg[cpu.OP_A] = cpu.OP_B
+    set_reg_a(cpu, cpu.OP_B)
 
 
 @opcode(0b00000000)
@@ -179,20 +194,20 @@ def NOP(cpu):
 @opcode(0b01000110)
 def POP(cpu):
     """Pop the value at the top of the stack into the given register."""
-    cpu.reg[cpu.OP_A] = cpu.ram_read(cpu.SP)
+    set_reg_a(cpu, cpu.ram_read(cpu.SP))
     cpu.SP += 1
 
 
 @opcode(0b01001000)
 def PRA(cpu):
     """Print alpha character value stored in the given register."""
-    print(chr(cpu.reg[cpu.OP_A]), end='', flush=True)
+    cpu.output.char(cpu.reg[cpu.OP_A])
 
 
 @opcode(0b01000111)
 def PRN(cpu):
     """Print numeric value stored in the given register."""
-    print(cpu.reg[cpu.OP_A])
+    cpu.output.number(cpu.reg[cpu.OP_A])
 
 
 @opcode(0b01000101)
@@ -216,11 +231,173 @@ def ST(cpu):
         f'invalid register: {cpu.OP_B}'
     cpu.ram_write(cpu.reg[cpu.OP_A], cpu.reg[cpu.OP_B])
 
+
 @opcode(0b10000000)
 def ADDI(cpu):
     """Add an immediate value to a register."""
-    cpu.reg[cpu.OP_A] += cpu.OP_B
-    cpu.reg[cpu.OP_A] &= ((1 << BITS) - 1)
+    set_reg_a(cpu, (cpu.reg[cpu.OP_A] + cpu.OP_B) & MASK)
+
+
+# opcode-indexed ALU implementation table, `None` for other opcodes
+# filled with `@alu_opcode(0b123123)` decorator; handlers take the CPU,
+# its register file and the operands, and write the register directly
+ALU_OPCODES = [None] * (1 << BITS)
+
+
+def alu_opcode(code):
+    """Decorator to build ALU_OPCODES table."""
+    def _(func):
+        ALU_OPCODES[code] = func
+        return func
+    return _
+
+
+@alu_opcode(0b10100000)
+def ADD(cpu, reg, a, b):
+    reg[a] = (reg[a] + reg[b]) & MASK
+
+
+@alu_opcode(0b10101000)
+def AND(cpu, reg, a, b):
+    reg[a] &= reg[b]
+
+
+@alu_opcode(0b10100111)
+def CMP(cpu, reg, a, b):
+    x, y = reg[a], reg[b]
+    cpu.FL = CMP_FLAGS[(x > y) - (x < y) + 1]
+
+
+@alu_opcode(0b01100110)
+def DEC(cpu, reg, a, b):
+    reg[a] = (reg[a] - 1) & MASK
+
+
+@alu_opcode(0b10100011)
+def DIV(cpu, reg, a, b):
+    if reg[b]:
+        reg[a] //= reg[b]
+    else:
+        cpu.output.text(f'ALU ERROR: DIV by 0 at {cpu.PC}\n')
+        cpu._running = False
+
+
+@alu_opcode(0b01100101)
+def INC(cpu, reg, a, b):
+    reg[a] = (reg[a] + 1) & MASK
+
+
+@alu_opcode(0b10100100)
+def MOD(cpu, reg, a, b):
+    if reg[b]:
+        reg[a] %= reg[b]
+    else:
+        cpu.output.text(f'ALU ERROR: MOD by 0 at {cpu.PC}\n')
+        cpu._running = False
+
+
+@alu_opcode(0b10100010)
+def MUL(cpu, reg, a, b):
+    reg[a] = (reg[a] * reg[b]) & MASK
+
+
+@alu_opcode(0b01101001)
+def NOT(cpu, reg, a, b):
+    reg[a] ^= MASK
+
+
+@alu_opcode(0b10101010)
+def OR(cpu, reg, a, b):
+    reg[a] |= reg[b]
+
+
+@alu_opcode(0b10101100)
+def SHL(cpu, reg, a, b):
+    reg[a] = (reg[a] << reg[b]) & MASK
+
+
+@alu_opcode(0b10101101)
+def SHR(cpu, reg, a, b):
+    reg[a] >>= reg[b]
+
+
+@alu_opcode(0b10100001)
+def SUB(cpu, reg, a, b):
+    reg[a] = (reg[a] - reg[b]) & MASK
+
+
+@alu_opcode(0b10101011)
+def XOR(cpu, reg, a, b):
+    reg[a] ^= reg[b]
+
+
+# ALU commands with a lookup table, see `alu_table`
+TABLE_ALU = ('CMP', 'DIV', 'MOD', 'MUL', 'SHL', 'SHR')
+
+# ALU command to lookup table, filled on first use by `alu_table`
+ALU_TABLES = {}
+
+# opcode-indexed ALU implementation table using the lookup tables,
+# filled on first use by `table_alu_opcodes`
+TABLE_ALU_OPCODES = []
+
+
+def alu_table(cmd):
+    """Return the lookup table for an ALU command, building it once.
+
+    The table is `bytes` indexed by `(x << BITS) | y` for the operand
+    values x and y: the FL value for CMP, the masked result otherwise.
+    Entries for division by zero are 0; handlers test the divisor first.
+    """
+    table = ALU_TABLES.get(cmd)
+    if table is None:
+        if cmd == 'CMP':
+            def op(x, y):
+                return CMP_FLAGS[(x > y) - (x < y) + 1]
+        elif cmd in ('DIV', 'MOD'):
+            def op(x, y):
+                return ALU_OP[cmd](x, y) if y else 0
+        else:
+            op = ALU_OP[cmd]
+        values = range(1 << BITS)
+        table = ALU_TABLES[cmd] = bytes(
+            op(x, y) & MASK for x in values for y in values)
+    return table
+
+
+def table_alu(code):
+    """Build the ALU handler for an opcode with a lookup table."""
+    cmd = ALU[code]
+    table = alu_table(cmd)
+
+    if cmd == 'CMP':
+        def handler(cpu, reg, a, b):
+            cpu.FL = table[reg[a] << BITS | reg[b]]
+    elif cmd in ('DIV', 'MOD'):
+        by_zero = ALU_OPCODES[code]
+
+        def handler(cpu, reg, a, b):
+            if reg[b]:
+                reg[a] = table[reg[a] << BITS | reg[b]]
+            else:
+                by_zero(cpu, reg, a, b)
+    else:
+        def handler(cpu, reg, a, b):
+            reg[a] = table[reg[a] << BITS | reg[b]]
+    handler.__name__ = cmd
+    return handler
+
+
+def table_alu_opcodes():
+    """Return `ALU_OPCODES` with lookup table handlers where they exist,
+    building the tables on the first call.
+    """
+    if not TABLE_ALU_OPCODES:
+        TABLE_ALU_OPCODES[:] = ALU_OPCODES
+        for code, cmd in ALU.items():
+            if cmd in TABLE_ALU:
+                TABLE_ALU_OPCODES[code] = table_alu(code)
+    return TABLE_ALU_OPCODES
 
 
 if __name__ == '__main__':
@@ -0,0 +1,65 @@
+"""Console output device for PRA and PRN.
+
+Characters and numbers are collected in a byte buffer and written out in
+one call, instead of a `print` and a flush per character. The buffer is
+flushed on every newline, on the run loops' device poll and when the CPU
+stops, so a terminal or a pipe shows output as it is produced, and at
+the latest when it passes `threshold` bytes.
+
+The sink may be a text stream, a binary stream such as `io.BytesIO`, or
+a `bytearray` to capture output in memory. Text is UTF-8 encoded for
+binary sinks.
+"""
+
+import sys
+from io import TextIOBase
+
+
+class Output:
+    """Buffered output to `stream`, by default the current stdout."""
+
+    def __init__(self, stream=None, threshold=4096):
+        self.stream = stream
+        self.threshold = threshold
+        self.buffer = bytearray()
+
+    def char(self, code):
+        """Write the character with the given code (PRA)."""
+        buffer = self.buffer
+        if code < 0x80:
+            buffer.append(code)
+        else:
+            buffer += chr(code).encode()
+        if code == 10 or len(buffer) >= self.threshold:
+            self.flush()
+
+    def number(self, value):
+        """Write a number and a newline (PRN)."""
+        self.buffer += b'%d\n' % value
+        self.flush()
+
+    def text(self, text):
+        """Write a line of text, such as an error message."""
+        self.buffer += text.encode()
+        self.flush()
+
+    def poll(self):
+        """Show pending output, called from the run loops' device poll."""
+        if self.buffer:
+            self.flush()
+
+    def flush(self):
+        """Write out the buffer."""
+        if not self.buffer:
+            return
+        stream = sys.stdout if self.stream is None else self.stream
+        if isinstance(stream, bytearray):
+            stream += self.buffer
+        elif isinstance(stream, TextIOBase):
+            stream.write(self.buffer.decode())
+            stream.flush()
+        else:
+            stream.write(self.buffer)
+            if hasattr(stream, 'flush'):
+                stream.flush()
+        self.buffer.clear()
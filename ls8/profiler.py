@@ -0,0 +1,150 @@
+"""Per-opcode, per-address and per-call profiling.
+
+`CPU.profile` runs the program on a copy of the fast engine loop that
+also counts every instruction, so `CPU.run` itself carries no profiling
+cost. A `Profile` records:
+
+* how many times each opcode ran, and each address was executed
+* calls and inclusive cycles per CALL target, tracked on a shadow stack
+  that CALL pushes and RET pops
+* dispatches and inclusive cycles per interrupt, from dispatch to IRET
+* cycles per call stack, written by `collapsed` in the collapsed-stack
+  format flamegraph tools read (`main;0x18;0x2a 120`)
+"""
+
+from collections import Counter
+
+from cpu import IM_REG, IS_REG, SP_REG
+from opcodes import ALU, OPCODES
+
+NAMES = {**{code: func.__name__ for code, func in OPCODES.items()}, **ALU}
+_CODES = {name: code for code, name in NAMES.items()}
+CALL_OPCODE, RET_OPCODE = _CODES['CALL'], _CODES['RET']
+IRET_OPCODE = _CODES['IRET']
+
+ROOT = 'main'
+
+
+class Profile:
+    """Counters collected by one profiled run."""
+
+    def __init__(self, memory_size):
+        self.opcodes = [0] * 256  # executions per opcode
+        self.addresses = [0] * memory_size  # executions per address
+        self.calls = {}  # CALL target -> [calls, inclusive cycles]
+        self.interrupts = {}  # interrupt -> [dispatches, inclusive cycles]
+        self.stacks = Counter()  # call stack tuple -> cycles
+        self.cycles = 0
+        self.reason = None
+
+    def report(self, top=20):
+        """Return the profile as text tables."""
+        total = self.cycles or 1
+        lines = [f'{self.cycles:,} cycles, stopped by {self.reason}', '',
+                 f'{"opcode":8} {"count":>12} {"%":>6}']
+        by_count = sorted(
+            ((count, NAMES.get(code, f'{code:08b}'))
+             for code, count in enumerate(self.opcodes) if count),
+            reverse=True)
+        for count, name in by_count:
+            lines.append(f'{name:8} {count:12,} {100 * count / total:6.2f}')
+
+        lines += ['', f'{"address":8} {"count":>12} {"%":>6}']
+        hot = sorted(
+            ((count, address)
+             for address, count in enumerate(self.addresses) if count),
+            reverse=True)[:top]
+        for count, address in hot:
+            lines.append(
+                f'{address:#8x} {count:12,} {100 * count / total:6.2f}')
+
+        for title, table in (('call', self.calls),
+                             ('interrupt', self.interrupts)):
+            if not table:
+                continue
+            lines += ['', f'{title:9} {"calls":>10} {"cycles":>12} {"%":>6}']
+            for key, (calls, cycles) in sorted(
+                    table.items(), key=lambda item: -item[1][1]):
+                name = f'{key:#x}' if title == 'call' else f'{key}'
+                lines.append(f'{name:9} {calls:10,} {cycles:12,} '
+                             f'{100 * cycles / total:6.2f}')
+        return '\n'.join(lines) + '\n'
+
+    def collapsed(self):
+        """Return the call stacks in collapsed-stack format."""
+        return ''.join(f'{";".join(stack)} {cycles}\n'
+                       for stack, cycles in sorted(self.stacks.items()))
+
+
+def run_profiled(cpu):
+    """Run the CPU on the fast handlers, counting as it goes."""
+    m, decode, interrupt, mask, null_interrupt, key_buffer = \
+        cpu._fast_setup()
+    reg, decoded = m.reg, m.decoded
+    profile = Profile(len(m.ram))
+    opcodes, addresses, stacks = \
+        profile.opcodes, profile.addresses, profile.stacks
+    calls, interrupts = profile.calls, profile.interrupts
+    frames = []  # (counters, cycles at entry) per shadow stack frame
+    stack = (ROOT,)
+
+    pc, ir = cpu.PC, cpu.IR
+    cycles = start = cpu.cycles
+    next_poll = cycles
+    m.running = True
+    try:
+        while m.running:
+            # trigger timer and keyboard interrupts, stop when asked to
+            if cycles >= next_poll:
+                next_poll = cpu.poll_devices(cycles, m.write, key_buffer)
+                if next_poll is None:
+                    break
+
+            pending = reg[IM_REG] & reg[IS_REG]
+            if pending:
+                pc = interrupt(m, pc, ir)
+                number = (pending & -pending).bit_length() - 1
+                counters = interrupts.setdefault(number, [0, 0])
+                counters[0] += 1
+                frames.append((counters, cycles))
+                stack += (f'interrupt{number}',)
+
+            # decode instruction at program counter, once per address
+            entry = decoded[pc] or decode(m, pc)
+            ir, handler, a, b, size = entry
+            assert size == 1 or pc + size <= reg[SP_REG], \
+                f'CPU.IR: instruction operands in stack at: {pc}'
+            opcodes[ir] += 1
+            addresses[pc] += 1
+            stacks[stack] += 1
+
+            # execute, handlers return the next program counter
+            pc = handler(m, pc, a, b) & mask
+            assert pc < reg[SP_REG] or pc == null_interrupt, \
+                f'invalid program counter: {pc}, stack: {reg[SP_REG]}'
+            cycles += 1
+
+            # follow calls and returns on the shadow stack
+            if ir == CALL_OPCODE:
+                counters = calls.setdefault(pc, [0, 0])
+                counters[0] += 1
+                frames.append((counters, cycles))
+                stack += (f'{pc:#x}',)
+            elif (ir == RET_OPCODE or ir == IRET_OPCODE) and frames:
+                counters, entered = frames.pop()
+                counters[1] += cycles - entered
+                stack = stack[:-1]
+    finally:
+        # frames still open when the run stops count up to the stop
+        for counters, entered in frames:
+            counters[1] += cycles - entered
+        profile.cycles = cycles - start
+        cpu.cycles = cycles
+        cpu._running = m.running
+        cpu._program_counter = pc
+        cpu._instruction_register = ir
+        cpu._flags = m.fl
+        cpu._old_IM = m.old_im
+        cpu.stop_devices()
+    profile.reason = cpu.stop_reason
+    return profile
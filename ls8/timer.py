@@ -0,0 +1,82 @@
+"""Timer interrupt sources.
+
+The run loops count executed instructions (cycles) and only ask the
+timer whether it fired once the count reaches `next_poll`, so there is
+no clock read per instruction.
+
+`WallTimer` fires about once per `interval` seconds of real time and
+reads the clock every `poll_cycles` instructions. `VirtualTimer` fires
+every `period` instructions, which makes runs reproducible and costs
+nothing between ticks.
+"""
+
+from time import time
+
+
+class WallTimer:
+    """Fire once per `interval` seconds of real time."""
+
+    def __init__(self, interval=1.0, poll_cycles=1024):
+        self.interval = interval
+        self.poll_cycles = poll_cycles
+        self.reset()
+
+    def reset(self):
+        """Forget the interval, called when the CPU is reset."""
+        self.last = None
+
+    def start(self):
+        """Start the interval on the first run after a reset.
+
+        Called whenever `CPU.run` starts; a run resuming where the last
+        one stopped, as `CPU.step` does, keeps the running interval.
+        """
+        if self.last is None:
+            self.last = time()
+
+    def resume(self, cycles):
+        """Start a new interval on the next run, after a restore."""
+        self.reset()
+
+    def poll(self, cycles):
+        """Return True if the timer fired."""
+        now = time()
+        if now - self.last > self.interval:
+            self.last = now
+            return True
+        return False
+
+    def next_poll(self, cycles):
+        """Cycle count at which the run loop should poll again."""
+        return cycles + self.poll_cycles
+
+
+class VirtualTimer:
+    """Fire every `period` cycles, independent of real time."""
+
+    def __init__(self, period):
+        assert period > 0, 'timer period must be positive'
+        self.period = period
+        self.reset()
+
+    def reset(self):
+        """Schedule the first tick, called when the CPU is reset."""
+        self.next_tick = self.period
+
+    def start(self):
+        """Nothing to do, virtual time only advances with cycles."""
+
+    def resume(self, cycles):
+        """Schedule the next tick after a restore at cycles."""
+        self.next_tick = max(-(-cycles // self.period), 1) * self.period
+
+    def poll(self, cycles):
+        """Return True if a tick is due, pending ticks are merged."""
+        if cycles < self.next_tick:
+            return False
+        self.next_tick = (cycles // self.period + 1) * self.period
+        return True
+
+    def next_poll(self, cycles):
+        """Cycle count of the next tick."""
+        return self.next_tick
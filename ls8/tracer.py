@@ -0,0 +1,131 @@
+"""Execution trace of the last instructions, kept in a ring buffer.
+
+Each record holds the PC, IR, operands and FL before the instruction
+ran, and the registers R0-R7, in one preallocated buffer of words. When
+the run stops with a fault or a failed assert the records are dumped to
+stderr, oldest first, so a crash in a long run can be diagnosed without
+logging every instruction.
+"""
+
+import sys
+from array import array
+
+from cpu import IM_REG, IS_REG, SP_REG
+from opcodes import REGISTERS
+from wide import LDI_OPCODE
+
+FIELDS = 5  # PC, IR, operand a, operand b, FL
+RECORD = FIELDS + REGISTERS
+
+
+class Trace:
+    """Ring buffer of the last `depth` instructions."""
+
+    def __init__(self, depth=64, bits=8):
+        assert depth > 0, 'trace depth must be positive'
+        self.depth = depth
+        self.bits = bits
+        if bits == 8:
+            self.buffer = bytearray(depth * RECORD)
+        else:
+            self.buffer = array('H', bytes(2 * depth * RECORD))
+        self.position = 0
+        self.count = 0  # instructions recorded
+
+    def record(self, pc, ir, a, b, fl, reg):
+        """Record an instruction about to run."""
+        buffer, i = self.buffer, self.position
+        buffer[i] = pc
+        buffer[i + 1] = ir
+        buffer[i + 2] = a
+        buffer[i + 3] = b
+        buffer[i + 4] = fl
+        buffer[i + FIELDS:i + RECORD] = reg
+        i += RECORD
+        self.position = 0 if i == len(buffer) else i
+        self.count += 1
+
+    def records(self):
+        """Return the recorded instructions, oldest first."""
+        buffer, end = self.buffer, len(self.buffer)
+        if self.count < self.depth:
+            order = range(0, self.count * RECORD, RECORD)
+        else:  # full: the oldest record is the next to be overwritten
+            start = self.position
+            order = list(range(start, end, RECORD)) + \
+                list(range(0, start, RECORD))
+        return [tuple(buffer[i:i + RECORD]) for i in order]
+
+    def format(self, record):
+        """Format a record like the old `CPU.trace` line, plus FL."""
+        width = 2 if self.bits == 8 else 4
+        pc, ir, a, b, fl, *reg = record
+        return (f'TRACE: {pc:0{width}X} | {ir:02X} {a:0{width}X} '
+                f'{b:0{width}X} | {fl:02X} |'
+                + ''.join(f' {value:0{width}X}' for value in reg))
+
+    def dump(self, file=None):
+        """Write the records, oldest first, to file (stderr)."""
+        file = sys.stderr if file is None else file
+        shown = min(self.count, self.depth)
+        print(f'last {shown} of {self.count} instructions '
+              f'(PC | IR A B | FL | R0-R{REGISTERS - 1}):', file=file)
+        for record in self.records():
+            print(self.format(record), file=file)
+
+
+def run_traced(cpu):
+    """Run the CPU on the fast handlers, recording every instruction."""
+    m, decode, interrupt, mask, null_interrupt, key_buffer = \
+        cpu._fast_setup()
+    ram, reg, decoded = m.ram, m.reg, m.decoded
+    record = cpu.trace.record
+    wide = cpu.bits != 8
+
+    pc, ir = cpu.PC, cpu.IR
+    cycles = cpu.cycles
+    next_poll = cycles
+    m.running = True
+    try:
+        while m.running:
+            # trigger timer and keyboard interrupts, stop when asked to
+            if cycles >= next_poll:
+                next_poll = cpu.poll_devices(cycles, m.write, key_buffer)
+                if next_poll is None:
+                    break
+
+            if reg[IM_REG] & reg[IS_REG]:
+                pc = interrupt(m, pc, ir)
+
+            # record the raw bytes like the checked engine, before decode
+            # can fail on them
+            ir = ram[pc]
+            b = ram[(pc + 2) & mask]
+            if wide and ir == LDI_OPCODE:
+                b |= ram[(pc + 3) & mask] << 8
+            record(pc, ir, ram[(pc + 1) & mask], b, m.fl, reg)
+
+            # decode instruction at program counter, once per address
+            entry = decoded[pc] or decode(m, pc)
+            ir, handler, a, b, size = entry
+            assert size == 1 or pc + size <= reg[SP_REG], \
+                f'CPU.IR: instruction operands in stack at: {pc}'
+
+            # execute, handlers return the next program counter
+            pc = handler(m, pc, a, b) & mask
+            assert pc < reg[SP_REG] or pc == null_interrupt, \
+                f'invalid program counter: {pc}, stack: {reg[SP_REG]}'
+            cycles += 1
+    except Exception:
+        cpu.output.flush()  # keep program output before the dump
+        cpu.trace.dump()
+        raise
+    finally:
+        cpu.cycles = cycles
+        cpu._running = m.running
+        cpu._program_counter = pc
+        cpu._instruction_register = ir
+        cpu._flags = m.fl
+        cpu._old_IM = m.old_im
+        cpu.stop_devices()
+    return cpu.stop_reason
@@ -0,0 +1,367 @@
+"""Lockstep execution of many LS-8 machines with NumPy.
+
+A `VectorCPU` holds N machines ("lanes") as arrays: `ram` (N, 256) and
+`reg` (N, 8) of uint8, and `pc`, `fl`, `ir` and `cycles` of shape (N,).
+Each `step` runs one instruction on every running lane. Lanes are grouped
+by the opcode at their PC, so lanes that branch differently simply end
+up in different groups, and each group is executed with array
+operations, the ALU with the `ALU_OP` semantics.
+
+Every lane follows the fast engine exactly, asserts included: a lane
+that would raise stops with the assert message in `errors`, leaving the
+other lanes running. There is no keyboard; `timer_period` raises the
+timer interrupt like a `VirtualTimer`, so lanes can be compared with
+scalar runs using one.
+
+NumPy is only needed for this module.
+"""
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from cpu import CPU, FAULT, FAST_OPCODES, HALT, IM_REG, IS_REG, LIMIT
+from cpu import INTERRUPTS, MAX_MEM, NULL_INTERRUPT, SP_REG, STACK_BASE
+from cpu import TIMER_INTERRUPT
+from opcodes import ALU, ALU_MASK, ALU_OP, BITS, OPCODES, REGISTERS
+
+MASK = MAX_MEM - 1
+VECTORS = MAX_MEM - INTERRUPTS
+
+NAMES = {**{code: func.__name__ for code, func in OPCODES.items()}, **ALU}
+
+JUMP_TEST = {  # conditional jump to flag mask, JNE jumps when clear
+    'JEQ': 0b1, 'JGE': 0b11, 'JGT': 0b10, 'JLE': 0b101, 'JLT': 0b100,
+    'JNE': 0b1,
+}
+
+
+class VectorCPU:
+    """N LS-8 machines stepped together."""
+
+    def __init__(self, lanes, timer_period=None):
+        if np is None:
+            raise ImportError('VectorCPU needs NumPy')
+        self.lanes = lanes
+        self.timer_period = timer_period
+        # allocated once, the opcode handlers keep references to them
+        self.ram = np.zeros((lanes, MAX_MEM), np.uint8)
+        self.reg = np.zeros((lanes, REGISTERS), np.uint8)
+        self.pc = np.zeros(lanes, np.int64)
+        self.ir = np.zeros(lanes, np.int64)
+        self.fl = np.zeros(lanes, np.uint8)
+        self.old_im = np.zeros(lanes, np.uint8)
+        self.cycles = np.zeros(lanes, np.int64)
+        self.running = np.zeros(lanes, dtype=bool)
+        self.reset(CPU())
+        self._lowest = np.array(
+            [(x & -x).bit_length() - 1 for x in range(MAX_MEM)])
+        self._valid = np.zeros(MAX_MEM, dtype=bool)
+        self._valid[list(FAST_OPCODES)] = True
+        self._handlers = {code: self._handler(code) for code in FAST_OPCODES}
+
+    def reset(self, cpu):
+        """Set every lane to the state of a scalar `cpu`."""
+        self.ram[:] = np.frombuffer(bytes(cpu.ram), np.uint8)
+        self.reg[:] = np.frombuffer(bytes(cpu.reg), np.uint8)
+        self.pc[:] = cpu.PC
+        self.ir[:] = cpu.IR
+        self.fl[:] = cpu.FL
+        self.old_im[:] = cpu._old_IM
+        self.cycles[:] = cpu.cycles
+        self.running[:] = True
+        self.errors = [None] * self.lanes  # assert message of faulted lanes
+        self.output = [bytearray() for _ in range(self.lanes)]  # per lane
+
+    def load(self, filename):
+        """Load the same program into every lane."""
+        cpu = CPU()
+        cpu.load(filename)
+        self.reset(cpu)
+
+    def reasons(self):
+        """Why each lane stopped: HALT, FAULT, or LIMIT if still running."""
+        return [FAULT if error else LIMIT if running else HALT
+                for error, running in zip(self.errors, self.running)]
+
+    def run(self, max_cycles=None):
+        """Step until every lane stopped or `max_cycles` steps ran."""
+        steps = 0
+        while (max_cycles is None or steps < max_cycles) and self.step():
+            steps += 1
+        return self.reasons()
+
+    def step(self):
+        """Run one instruction on every running lane.
+
+        Returns the number of lanes that were running.
+        """
+        lanes = np.flatnonzero(self.running)
+        count = lanes.size
+        if not count:
+            return 0
+        reg, ram = self.reg, self.ram
+
+        # trigger timer interrupt, polled when cycles reach the tick
+        if self.timer_period:
+            cycles = self.cycles[lanes]
+            tick = lanes[(cycles > 0) & (cycles % self.timer_period == 0)]
+            reg[tick, IS_REG] |= 1 << TIMER_INTERRUPT
+
+        pending = reg[lanes, IM_REG] & reg[lanes, IS_REG]
+        if pending.any():
+            self._interrupt(lanes[pending != 0], pending[pending != 0])
+            lanes = lanes[self.running[lanes]]
+
+        # decode, with the asserts of `fast_decode`
+        pc = self.pc[lanes]
+        ir = ram[lanes, pc].astype(np.int64)
+        ok = self._check(lanes, self._valid[ir], lambda lane: (
+            f'CPU.IR: invalid opcode: {ram[lane, self.pc[lane]]:08b} '
+            f'at: {self.pc[lane]}'))
+        lanes, pc, ir = lanes[ok], pc[ok], ir[ok]
+        size = 1 + (ir >> 6)
+        ok = self._check(
+            lanes, (size == 1) | (pc + size - 1 < reg[lanes, SP_REG]),
+            lambda lane: f'CPU.IR: instruction operands in stack at: '
+                         f'{self.pc[lane]}')
+        lanes, pc, ir, size = lanes[ok], pc[ok], ir[ok], size[ok]
+        a = ram[lanes, np.minimum(pc + 1, MASK)].astype(np.int64)
+        b = ram[lanes, np.minimum(pc + 2, MASK)].astype(np.int64)
+        ok = self._check(lanes, (size == 1) | (a < REGISTERS), lambda lane:
+                         f'operand_a out of range: '
+                         f'{ram[lane, self.pc[lane] + 1]}')
+        lanes, pc, ir, size, a, b = \
+            lanes[ok], pc[ok], ir[ok], size[ok], a[ok], b[ok]
+        ok = self._check(
+            lanes, (size < 3) | (b < REGISTERS) | (ir & ALU_MASK == 0),
+            lambda lane: f'operand_b out of range for ALU operation: '
+                         f'{ram[lane, self.pc[lane] + 2]}')
+        lanes, pc, ir, a, b = lanes[ok], pc[ok], ir[ok], a[ok], b[ok]
+        a = np.minimum(a, REGISTERS - 1)  # unused operands may be any byte
+        self.ir[lanes] = ir
+
+        # execute each opcode group, handlers return surviving lanes and
+        # their next program counter
+        for code in np.unique(ir).tolist():
+            group = ir == code
+            done, next_pc = self._handlers[code](
+                lanes[group], pc[group], a[group], b[group])
+            next_pc = next_pc & MASK
+            self.pc[done] = next_pc
+            ok = self._check(
+                done, (next_pc < reg[done, SP_REG]) |
+                (next_pc == NULL_INTERRUPT), lambda lane: (
+                    f'invalid program counter: {self.pc[lane]}, '
+                    f'stack: {reg[lane, SP_REG]}'))
+            self.cycles[done[ok]] += 1
+        return count
+
+    def _check(self, lanes, ok, message):
+        """Fault the lanes where ok is False, return ok.
+
+        `message(lane)` is the assert message for a failing lane.
+        """
+        for lane in lanes[~ok].tolist():
+            self.errors[lane] = message(lane)
+            self.running[lane] = False
+        return ok
+
+    def _push_sp(self, lanes, last):
+        """Decrement SP like `push_sp`, return the lanes that passed."""
+        sp = (self.reg[lanes, SP_REG].astype(np.int64) - 1) & MASK
+        ok = self._check(lanes, sp <= STACK_BASE,
+                         lambda lane: 'stack pointer out of range')
+        ok[ok] = self._check(
+            lanes[ok], (last[ok] < sp[ok]) | (last[ok] == NULL_INTERRUPT),
+            lambda lane: 'stack cannot overlap executing code')
+        self.reg[lanes[ok], SP_REG] = sp[ok]
+        return ok
+
+    def _pop_sp(self, lanes, last):
+        """Increment SP like `pop_sp`, return the lanes that passed."""
+        sp = (self.reg[lanes, SP_REG].astype(np.int64) + 1) & MASK
+        ok = self._check(lanes, sp <= STACK_BASE,
+                         lambda lane: 'stack pointer out of range')
+        ok[ok] = self._check(
+            lanes[ok], (last[ok] < sp[ok]) | (last[ok] == NULL_INTERRUPT),
+            lambda lane: 'stack cannot overlap executing code')
+        self.reg[lanes[ok], SP_REG] = sp[ok]
+        return ok
+
+    def _push(self, lanes, last, value):
+        """Push a value per lane, return the lanes that passed."""
+        ok = self._push_sp(lanes, last)
+        lanes = lanes[ok]
+        self.ram[lanes, self.reg[lanes, SP_REG]] = value[ok]
+        return ok
+
+    def _interrupt(self, lanes, pending):
+        """Dispatch the lowest pending interrupt, like `fast_interrupt`."""
+        reg, ram = self.reg, self.ram
+        number = self._lowest[pending]
+        self.old_im[lanes] = reg[lanes, IM_REG]
+        reg[lanes, IM_REG] = 0
+        reg[lanes, IS_REG] &= (MASK ^ (1 << number)).astype(np.uint8)
+        pc = self.pc[lanes]
+        last = pc + (self.ir[lanes] >> 6)
+        values = [pc, self.fl[lanes]] + \
+            [reg[lanes, i] for i in range(REGISTERS - 1)]
+        for i in range(len(values)):
+            ok = self._push(lanes, last, values[i])
+            lanes, last, number = lanes[ok], last[ok], number[ok]
+            values = [value[ok] for value in values]
+        handler = ram[lanes, VECTORS + number].astype(np.int64)
+        target = dict(zip(lanes.tolist(), handler.tolist()))
+        ok = self._check(lanes, (handler < reg[lanes, SP_REG]) |
+                         (handler == NULL_INTERRUPT), lambda lane: (
+                             f'invalid program counter: {target[lane]}, '
+                             f'stack: {reg[lane, SP_REG]}'))
+        self.pc[lanes[ok]] = handler[ok]
+
+    def _print(self, lanes, values, number):
+        """PRA or PRN per lane."""
+        for lane, value in zip(lanes.tolist(), values.tolist()):
+            if number:
+                self.output[lane] += b'%d\n' % value
+            else:
+                self.output[lane] += chr(value).encode()
+
+    def _handler(self, code):
+        """Build the array implementation of an opcode.
+
+        Handlers take `(lanes, pc, a, b)` and return the lanes that did
+        not fault with their next program counter.
+        """
+        name = NAMES[code]
+        size = 1 + (code >> 6)
+        reg, ram, fl = self.reg, self.ram, self.fl
+
+        if code & ALU_MASK:
+            op = ALU_OP[name]
+
+            def handler(lanes, pc, a, b):
+                x = reg[lanes, a].astype(np.int64)
+                y = reg[lanes, b].astype(np.int64) if size == 3 else None
+                if name == 'CMP':
+                    fl[lanes] = np.where(x == y, 1, np.where(x > y, 2, 4))
+                    return lanes, pc + size
+                if name in ('DIV', 'MOD'):
+                    zero = y == 0
+                    for lane, at in zip(lanes[zero].tolist(),
+                                        pc[zero].tolist()):
+                        self.output[lane] += \
+                            f'ALU ERROR: {name} by 0 at {at}\n'.encode()
+                    self.running[lanes[zero]] = False
+                    ok = ~zero
+                    reg[lanes[ok], a[ok]] = op(x[ok], y[ok]) & MASK
+                    return lanes, pc + size
+                if name in ('SHL', 'SHR'):
+                    y = np.minimum(y, 2 * BITS - 1)  # same bits as Python
+                reg[lanes, a] = op(x, y) & MASK
+                return lanes, pc + size
+            return handler
+
+        if name == 'ADDI':
+            def handler(lanes, pc, a, b):
+                reg[lanes, a] = (reg[lanes, a].astype(np.int64) + b) & MASK
+                return lanes, pc + 3
+        elif name == 'CALL':
+            def handler(lanes, pc, a, b):
+                ok = self._push(lanes, pc + 1, (pc + 2) & MASK)
+                lanes, a = lanes[ok], a[ok]
+                return lanes, reg[lanes, a].astype(np.int64)
+        elif name == 'HLT':
+            def handler(lanes, pc, a, b):
+                self.running[lanes] = False
+                return lanes, pc + 1
+        elif name == 'INT':
+            def handler(lanes, pc, a, b):
+                value = reg[lanes, a].astype(np.int64)
+                ok = self._check(lanes, value < BITS, lambda lane:
+                                 f'invalid interrupt: '
+                                 f'{reg[lane, ram[lane, self.pc[lane] + 1]]}')
+                lanes = lanes[ok]
+                reg[lanes, IS_REG] |= (1 << value[ok]).astype(np.uint8)
+                return lanes, pc[ok] + 2
+        elif name == 'IRET':
+            def handler(lanes, pc, a, b):
+                for i in range(REGISTERS - 2, -1, -1):  # pop R6-R0
+                    reg[lanes, i] = ram[lanes, reg[lanes, SP_REG]]
+                    ok = self._pop_sp(lanes, pc)
+                    lanes, pc = lanes[ok], pc[ok]
+                fl[lanes] = ram[lanes, reg[lanes, SP_REG]]  # pop flags
+                ok = self._pop_sp(lanes, pc)
+                lanes = lanes[ok]
+                pc = ram[lanes, reg[lanes, SP_REG]].astype(np.int64)
+                ok = self._check(lanes, (pc < reg[lanes, SP_REG]) |
+                                 (pc == NULL_INTERRUPT), lambda lane: (
+                                     f'invalid program counter: '
+                                     f'{ram[lane, reg[lane, SP_REG]]}, '
+                                     f'stack: {reg[lane, SP_REG]}'))
+                lanes, pc = lanes[ok], pc[ok]
+                ok = self._pop_sp(lanes, pc)
+                lanes, pc = lanes[ok], pc[ok]
+                reg[lanes, IM_REG] = self.old_im[lanes]
+                return lanes, pc
+        elif name == 'JMP':
+            def handler(lanes, pc, a, b):
+                return lanes, reg[lanes, a].astype(np.int64)
+        elif name in JUMP_TEST:
+            test = JUMP_TEST[name]
+            clear = name == 'JNE'
+
+            def handler(lanes, pc, a, b):
+                jump = (fl[lanes] & test) != 0
+                if clear:
+                    jump = ~jump
+                return lanes, np.where(jump, reg[lanes, a], pc + 2)
+        elif name in ('LD', 'ST'):
+            def handler(lanes, pc, a, b):
+                ok = self._check(lanes, b < REGISTERS, lambda lane:
+                                 f'invalid register: '
+                                 f'{ram[lane, self.pc[lane] + 2]}')
+                lanes, pc, a, b = lanes[ok], pc[ok], a[ok], b[ok]
+                if name == 'LD':
+                    reg[lanes, a] = ram[lanes, reg[lanes, b]]
+                else:
+                    ram[lanes, reg[lanes, a]] = reg[lanes, b]
+                return lanes, pc + 3
+        elif name == 'LDI':
+            def handler(lanes, pc, a, b):
+                reg[lanes, a] = b
+                return lanes, pc + 3
+        elif name == 'NOP':
+            def handler(lanes, pc, a, b):
+                return lanes, pc + 1
+        elif name == 'POP':
+            def handler(lanes, pc, a, b):
+                reg[lanes, a] = ram[lanes, reg[lanes, SP_REG]]
+                ok = self._pop_sp(lanes, pc + 1)
+                return lanes[ok], pc[ok] + 2
+        elif name in ('PRA', 'PRN'):
+            number = name == 'PRN'
+
+            def handler(lanes, pc, a, b):
+                self._print(lanes, reg[lanes, a], number)
+                return lanes, pc + 2
+        elif name == 'PUSH':
+            def handler(lanes, pc, a, b):
+                ok = self._push_sp(lanes, pc + 1)
+                lanes, pc, a = lanes[ok], pc[ok], a[ok]
+                # after the push, PUSH R7 stores the new SP
+                ram[lanes, reg[lanes, SP_REG]] = reg[lanes, a]
+                return lanes, pc + 2
+        elif name == 'RET':
+            def handler(lanes, pc, a, b):
+                pc = ram[lanes, reg[lanes, SP_REG]].astype(np.int64)
+                ok = self._check(lanes, (pc < reg[lanes, SP_REG]) |
+                                 (pc == NULL_INTERRUPT), lambda lane: (
+                                     f'invalid program counter: '
+                                     f'{ram[lane, reg[lane, SP_REG]]}, '
+                                     f'stack: {reg[lane, SP_REG]}'))
+                lanes, pc = lanes[ok], pc[ok]
+                ok = self._pop_sp(lanes, pc)
+                return lanes[ok], pc[ok]
+        return handler
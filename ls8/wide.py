@@ -0,0 +1,305 @@
+"""16-bit mode for the fast engine.
+
+Registers and addresses are 16 bits wide over a flat 64 KiB memory. The
+instruction set is the same with two differences: the LDI immediate is
+two bytes, little-endian, so LDI is four bytes long, and the stack holds
+words. PUSH, POP, CALL, RET, interrupts and IRET move two bytes per
+value, low byte first. LD and ST still move single bytes, ST stores the
+low byte of the register.
+
+Memory layout, from the top: eight two-byte interrupt vectors at
+`WIDE_VECTORS`, an IRET at `WIDE_NULL_INTERRUPT`, reserved bytes, and
+`WIDE_STACK_BASE`, which is also the keyboard buffer.
+"""
+
+from cpu import FastState, IM_REG, IS_REG, INTERRUPTS, SP_REG, WRITES_A
+from cpu import WIDE_MAX_MEM, WIDE_NULL_INTERRUPT, WIDE_STACK_BASE
+from cpu import WIDE_VECTORS, flag_pending
+from opcodes import ALU, ALU_MASK, ALU_OP, BITS, CMP_FLAGS, OPCODES
+from opcodes import REGISTERS
+
+MASK = WIDE_MAX_MEM - 1
+
+# opcode to 16-bit implementation map, keyed like `OPCODES`
+# filled with `@wide_opcode('NAME')` decorator
+WIDE_OPCODES = {}
+_OPCODE_NAMES = {func.__name__: code for code, func in OPCODES.items()}
+LDI_OPCODE = _OPCODE_NAMES['LDI']
+
+
+def wide_opcode(name):
+    """Decorator to build WIDE_OPCODES table."""
+    def _(func):
+        return WIDE_OPCODES.setdefault(_OPCODE_NAMES[name], func)
+    return _
+
+
+class WideState(FastState):
+    """Fast engine state for 16-bit mode."""
+    __slots__ = ()
+
+    def write(self, address, value):
+        """Store a byte at address, dropping cached code covering it."""
+        self.ram[address] = value
+        decoded = self.decoded
+        decoded[address] = decoded[address - 1] = None
+        decoded[address - 2] = decoded[address - 3] = None
+
+    def write_word(self, address, value):
+        """Store a little-endian word at address."""
+        self.write(address, value & 0xFF)
+        self.write(address + 1, value >> 8)
+
+    def read_word(self, address):
+        """Load a little-endian word from address."""
+        return self.ram[address] | self.ram[address + 1] << 8
+
+
+def size(ir):
+    """Instruction length in bytes."""
+    return 1 + (ir >> 6) + (ir == LDI_OPCODE)
+
+
+def wide_decode(m, pc):
+    """Decode and validate the instruction at pc, caching the result."""
+    ram, reg = m.ram, m.reg
+    ir = ram[pc]
+    handler = WIDE_OPCODES.get(ir)
+    assert handler is not None, \
+        f'CPU.IR: invalid opcode: {ir:08b} at: {pc}'
+    length = size(ir)
+    assert length == 1 or pc + length <= reg[SP_REG], \
+        f'CPU.IR: instruction operands in stack at: {pc}'
+    a = ram[pc + 1] if length > 1 else None
+    assert a is None or a < REGISTERS, f'operand_a out of range: {a}'
+    if ir == LDI_OPCODE:
+        b = m.read_word(pc + 2)
+    else:
+        b = ram[pc + 2] if length > 2 else None
+    assert b is None or b < REGISTERS or not ir & ALU_MASK, \
+        f'operand_b out of range for ALU operation: {b}'
+    if (a == IM_REG or a == IS_REG) and ir in WRITES_A:
+        handler = flag_pending(handler)
+    entry = m.decoded[pc] = (ir, handler, a, b, length)
+    return entry
+
+
+def push_sp(reg, last):
+    """Make room for a word on the stack, return the new SP."""
+    sp = (reg[SP_REG] - 2) & MASK
+    assert sp <= WIDE_STACK_BASE, 'stack pointer out of range'
+    assert last < sp or last == WIDE_NULL_INTERRUPT, \
+        'stack cannot overlap executing code'
+    reg[SP_REG] = sp
+    return sp
+
+
+def pop_sp(reg, last):
+    """Drop a word from the stack, return the new SP."""
+    sp = (reg[SP_REG] + 2) & MASK
+    assert sp <= WIDE_STACK_BASE, 'stack pointer out of range'
+    assert last < sp or last == WIDE_NULL_INTERRUPT, \
+        'stack cannot overlap executing code'
+    reg[SP_REG] = sp
+    return sp
+
+
+def wide_interrupt(m, pc, ir):
+    """Dispatch the lowest pending interrupt, return the handler address."""
+    reg = m.reg
+    pending = reg[IM_REG] & reg[IS_REG]
+    interrupt = (pending & -pending).bit_length() - 1  # lowest set bit
+    m.old_im = reg[IM_REG]  # save interrupt state
+    reg[IM_REG] = 0  # disable interrupts
+    reg[IS_REG] &= MASK ^ (1 << interrupt)  # clear interrupt
+    last = pc + size(ir) - 1
+    m.write_word(push_sp(reg, last), pc)  # push program counter
+    m.write_word(push_sp(reg, last), m.fl)  # push flags
+    for i in range(REGISTERS - 1):  # push R0-R6
+        m.write_word(push_sp(reg, last), reg[i])
+    pc = m.read_word(WIDE_VECTORS + 2 * interrupt)  # PC <- handler
+    assert pc < reg[SP_REG] or pc == WIDE_NULL_INTERRUPT, \
+        f'invalid program counter: {pc}, stack: {reg[SP_REG]}'
+    return pc
+
+
+def wide_alu(code, cmd):
+    """Build the 16-bit handler for an ALU opcode."""
+    op = ALU_OP[cmd]
+    length = size(code)
+
+    if cmd == 'CMP':
+        def handler(m, pc, a, b):
+            reg = m.reg
+            x, y = reg[a], reg[b]
+            m.fl = CMP_FLAGS[(x > y) - (x < y) + 1]
+            return pc + length
+    elif cmd in ('DIV', 'MOD'):
+        def handler(m, pc, a, b):
+            reg = m.reg
+            if reg[b]:
+                reg[a] = op(reg[a], reg[b])
+            else:
+                m.output.text(f'ALU ERROR: {cmd} by 0 at {pc}\n')
+                m.running = False
+            return pc + length
+    elif length == 2:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            reg[a] = op(reg[a], None) & MASK
+            return pc + length
+    else:
+        def handler(m, pc, a, b):
+            reg = m.reg
+            reg[a] = op(reg[a], reg[b]) & MASK
+            return pc + length
+    return handler
+
+
+for _code, _cmd in ALU.items():
+    WIDE_OPCODES[_code] = wide_alu(_code, _cmd)
+
+
+@wide_opcode('ADDI')
+def wide_addi(m, pc, a, b):
+    m.reg[a] = (m.reg[a] + b) & MASK
+    return pc + 3
+
+
+@wide_opcode('CALL')
+def wide_call(m, pc, a, b):
+    reg = m.reg
+    m.write_word(push_sp(reg, pc + 1), pc + 2)
+    return reg[a]
+
+
+@wide_opcode('HLT')
+def wide_hlt(m, pc, a, b):
+    m.running = False
+    return pc + 1
+
+
+@wide_opcode('INT')
+def wide_int(m, pc, a, b):
+    reg = m.reg
+    assert reg[a] < BITS, f'invalid interrupt: {reg[a]}'
+    reg[IS_REG] |= (1 << reg[a])
+    m.pending = True
+    return pc + 2
+
+
+@wide_opcode('IRET')
+def wide_iret(m, pc, a, b):
+    reg = m.reg
+    for i in range(6, -1, -1):  # pop R6-R0
+        reg[i] = m.read_word(reg[SP_REG])
+        pop_sp(reg, pc)
+    m.fl = m.read_word(reg[SP_REG])  # pop flags
+    pop_sp(reg, pc)
+    pc = m.read_word(reg[SP_REG])  # pop program counter
+    assert pc < reg[SP_REG] or pc == WIDE_NULL_INTERRUPT, \
+        f'invalid program counter: {pc}, stack: {reg[SP_REG]}'
+    pop_sp(reg, pc)
+    reg[IM_REG] = m.old_im  # restore interrupt mask
+    m.pending = True
+    return pc
+
+
+@wide_opcode('JEQ')
+def wide_jeq(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b1 else pc + 2
+
+
+@wide_opcode('JGE')
+def wide_jge(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b11 else pc + 2
+
+
+@wide_opcode('JGT')
+def wide_jgt(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b10 else pc + 2
+
+
+@wide_opcode('JLE')
+def wide_jle(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b101 else pc + 2
+
+
+@wide_opcode('JLT')
+def wide_jlt(m, pc, a, b):
+    return m.reg[a] if m.fl & 0b100 else pc + 2
+
+
+@wide_opcode('JMP')
+def wide_jmp(m, pc, a, b):
+    return m.reg[a]
+
+
+@wide_opcode('JNE')
+def wide_jne(m, pc, a, b):
+    return pc + 2 if m.fl & 0b1 else m.reg[a]
+
+
+@wide_opcode('LD')
+def wide_ld(m, pc, a, b):
+    reg = m.reg
+    assert b < REGISTERS, f'invalid register: {b}'
+    reg[a] = m.ram[reg[b]]
+    return pc + 3
+
+
+@wide_opcode('LDI')
+def wide_ldi(m, pc, a, b):
+    m.reg[a] = b
+    return pc + 4
+
+
+@wide_opcode('NOP')
+def wide_nop(m, pc, a, b):
+    return pc + 1
+
+
+@wide_opcode('POP')
+def wide_pop(m, pc, a, b):
+    reg = m.reg
+    reg[a] = m.read_word(reg[SP_REG])
+    pop_sp(reg, pc + 1)
+    return pc + 2
+
+
+@wide_opcode('PRA')
+def wide_pra(m, pc, a, b):
+    m.output.char(m.reg[a])
+    return pc + 2
+
+
+@wide_opcode('PRN')
+def wide_prn(m, pc, a, b):
+    m.output.number(m.reg[a])
+    return pc + 2
+
+
+@wide_opcode('PUSH')
+def wide_push(m, pc, a, b):
+    reg = m.reg
+    sp = push_sp(reg, pc + 1)
+    m.write_word(sp, reg[a])  # after the push, PUSH R7 stores the new SP
+    return pc + 2
+
+
+@wide_opcode('RET')
+def wide_ret(m, pc, a, b):
+    reg = m.reg
+    pc = m.read_word(reg[SP_REG])
+    assert pc < reg[SP_REG] or pc == WIDE_NULL_INTERRUPT, \
+        f'invalid program counter: {pc}, stack: {reg[SP_REG]}'
+    pop_sp(reg, pc)
+    return pc
+
+
+@wide_opcode('ST')
+def wide_st(m, pc, a, b):
+    reg = m.reg
+    assert b < REGISTERS, f'invalid register: {b}'
+    m.write(reg[a], reg[b] & 0xFF)
+    return pc + 3
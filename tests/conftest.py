@@ -0,0 +1,7 @@
+"""Put the emulator and assembler modules on the import path."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'ls8'), os.path.join(ROOT, 'asm')]
@@ -0,0 +1,22 @@
+"""Static analysis of loaded programs."""
+
+import io
+
+from analyze import analyze
+from cpu import CPU, FAULT
+from keyboard import Keyboard
+from output import Output
+from timer import VirtualTimer
+
+
+def test_instruction_at_end_of_memory():
+    cpu = CPU(engine='fast', timer=VirtualTimer(1000),
+              keyboard=Keyboard(io.StringIO()), output=Output(bytearray()))
+    # LDI R0,0xFE; JMP R0 to a PRN R0 in the last two bytes
+    cpu.ram[:5] = bytes([0x82, 0, 0xFE, 0x54, 0])
+    cpu.ram[0xFE:] = bytes([0x47, 0])
+    analysis = analyze(cpu)
+    assert not analysis.safe
+    assert 'execution runs past the end of memory' in analysis.problems
+    assert cpu.step(10) == FAULT
+    assert isinstance(cpu.fault, AssertionError)
@@ -0,0 +1,49 @@
+"""Assembling files and directories with asm.py."""
+
+import pytest
+
+import asm
+
+
+def built(tmp_path, **options):
+    """Build every source in tmp_path, return the outputs written."""
+    sources = sorted(str(source) for source in tmp_path.glob('*.asm'))
+    return [output for _, output, error in
+            asm.build_all(sources, str(tmp_path), jobs=1, **options)
+            if error is None]
+
+
+def test_rebuild_on_options(tmp_path):
+    (tmp_path / 'a.asm').write_text('LDI R0,8\nPRN R0\nHLT\n')
+    assert len(built(tmp_path)) == 1
+    assert built(tmp_path) == []
+    assert len(built(tmp_path, wide=True)) == 1
+    assert built(tmp_path, wide=True) == []
+    assert len(built(tmp_path, optimize=True)) == 1
+    assert len(built(tmp_path)) == 1
+    (tmp_path / 'a.asm').write_text('LDI R0,9\nPRN R0\nHLT\n')
+    assert len(built(tmp_path)) == 1
+    assert len(built(tmp_path, force=True)) == 1
+
+
+@pytest.mark.parametrize('source, error', [
+    ('LDI R0,300\nHLT\n', 'line 1: immediate out of range: 300\n'),
+    ('DS café€\n', 'line 1: DS character out of range: 8364\n'),
+    ('LDI R0,END\nDS ' + 'x' * 300 + '\nEND:\nHLT\n',
+     'symbol END out of range: 303\n'),
+])
+@pytest.mark.parametrize('suffix', ['.ls8', '.ls8b'])
+def test_range_errors(tmp_path, source, error, suffix):
+    (tmp_path / 'a.asm').write_text(source)
+    assert asm.assemble_file(
+        str(tmp_path / 'a.asm'), str(tmp_path / ('a' + suffix))) == \
+        error.strip()
+
+
+def test_peephole_labels():
+    source = ['LDI R0,1', 'Here:', 'LDI R0,1', 'Loop:', 'LDI R0,1',
+              'LDI R1,Loop', 'JMP R1']
+    assert [token[1:] for token in asm.peephole(asm.tokenize(source))] == [
+        (None, 'LDI', 'R0', '1'), ('HERE', None, None, None),
+        ('LOOP', None, None, None), (None, 'LDI', 'R0', '1'),
+        (None, 'LDI', 'R1', 'LOOP'), (None, 'JMP', 'R1', None)]
@@ -0,0 +1,37 @@
+"""Running programs in parallel with ls8.py batch."""
+
+import io
+import json
+import os
+
+import batch
+
+PRINT8 = '10000010\n00000000\n00001000\n01000111\n00000000\n00000001\n'
+run_program = batch.run_program
+
+
+def flaky(filename, **options):
+    """run_program, except that crash.ls8 kills and raise.ls8 raises."""
+    name = os.path.basename(filename)
+    if name == 'crash.ls8':
+        os._exit(1)
+    if name == 'raise.ls8':
+        raise RuntimeError('worker failed')
+    return run_program(filename, **options)
+
+
+def test_failures_get_their_own_rows(tmp_path, monkeypatch):
+    names = ['a.ls8', 'crash.ls8', 'b.ls8', 'raise.ls8', 'c.ls8']
+    for name in names:
+        (tmp_path / name).write_text(PRINT8)
+    programs = [str(tmp_path / name) for name in names]
+    monkeypatch.setattr(batch, 'run_program', flaky)
+    out = io.StringIO()
+    assert batch.run_batch(programs, out, jobs=2) == 2
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [result['program'] for result in results] == programs
+    assert [result['reason'] for result in results] == \
+        ['HLT', 'fault', 'HLT', 'fault', 'HLT']
+    assert results[0]['output'] == '8\n'
+    assert results[1]['error'].startswith('BrokenProcessPool')
+    assert results[3]['error'] == 'RuntimeError: worker failed'
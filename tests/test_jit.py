@@ -0,0 +1,86 @@
+"""The jit engine runs and stops with the fast engine's state."""
+
+import io
+import os
+
+import pytest
+
+import jit
+from cpu import CPU, FAULT, HALT
+from keyboard import Keyboard
+from output import Output
+from timer import VirtualTimer
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'ls8', 'examples')
+
+
+class Full:
+    """Binary sink whose third write fails."""
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes == 3:
+            raise OSError('sink full')
+
+
+def machine(engine, output):
+    return CPU(engine=engine, timer=VirtualTimer(1000),
+               keyboard=Keyboard(io.StringIO()), output=Output(output))
+
+
+def run(engine, program, output=None):
+    """Step program to its fault, return the CPU."""
+    cpu = machine(engine, bytearray() if output is None else output)
+    cpu.ram[:len(program)] = bytes(program)
+    assert cpu.step(100) == FAULT
+    return cpu
+
+
+def state(cpu):
+    return str(cpu.fault), cpu.PC, cpu.IR, cpu.cycles, list(cpu.reg), cpu.FL
+
+
+@pytest.mark.parametrize('program, pc', [
+    # LDI R0,5; LDI R1,7; POP R2 with an empty stack
+    ([0x82, 0, 5, 0x82, 1, 7, 0x46, 2], 6),
+    # LDI R0,1; LDI R7,8; PUSH R0 into its own code
+    ([0x82, 0, 1, 0x82, 7, 8, 0x45, 0], 6),
+])
+def test_fault_state(program, pc):
+    cpu = run('jit', program)
+    assert cpu.PC == pc
+    assert state(cpu) == state(run('fast', program))
+    cpu.snapshot()
+
+
+def test_compiled_fault_state(monkeypatch):
+    monkeypatch.setattr(jit, 'COMPILE_AFTER', 0)
+    # LDI R0,1; Loop: PRN R0; INC R0; LDI R1,Loop; JMP R1, until the
+    # output fails in the third PRN
+    program = [0x82, 0, 1, 0x47, 0, 0x65, 0, 0x82, 1, 3, 0x54, 1]
+    cpu = run('jit', program, Full())
+    assert cpu._compiled is not None
+    assert cpu.PC == 3 and cpu.cycles == 9 and cpu.reg[0] == 3
+    assert state(cpu) == state(run('fast', program, Full()))
+
+
+@pytest.mark.parametrize('name', [
+    'histogram', 'interrupts', 'keyboard', 'printstr', 'sctest',
+])
+def test_compiled_examples(monkeypatch, name):
+    monkeypatch.setattr(jit, 'COMPILE_AFTER', 0)
+    results = []
+    for engine in ('fast', 'jit'):
+        output = bytearray()
+        cpu = machine(engine, output)
+        cpu.load(os.path.join(EXAMPLES, f'{name}.ls8'))
+        for _ in range(40):
+            if cpu.step(777) == HALT:
+                break
+        results.append((bytes(output), cpu.snapshot()))
+    assert cpu._compiled is not None
+    assert results[1] == results[0]
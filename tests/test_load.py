@@ -0,0 +1,25 @@
+"""Loading .ls8 text and .ls8b images."""
+
+import pytest
+
+from cpu import CPU
+
+
+@pytest.mark.parametrize('name, data, message', [
+    ('short.ls8b', b'LS8B\x01', 'truncated image'),
+    ('magic.ls8b', b'LS8B', 'truncated image'),
+    ('junk.ls8', bytes(range(128, 256)), 'not an LS-8 program'),
+])
+def test_bad_file(tmp_path, name, data, message):
+    (tmp_path / name).write_bytes(data)
+    with pytest.raises(AssertionError, match=message):
+        CPU().load(str(tmp_path / name))
+
+
+def test_text(tmp_path):
+    (tmp_path / 'print8.ls8').write_text(
+        '10000010 # LDI R0,8\n00000000\n00001000\n'
+        '01000111 # PRN R0\n00000000\n00000001 # HLT\n')
+    cpu = CPU()
+    cpu.load(str(tmp_path / 'print8.ls8'))
+    assert bytes(cpu.ram[:6]) == bytes([0x82, 0, 8, 0x47, 0, 1])
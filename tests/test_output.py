@@ -0,0 +1,27 @@
+"""Buffered PRA/PRN output."""
+
+import io
+
+from output import Output
+
+
+def test_flush_on_newline_and_poll():
+    stream = io.BytesIO()  # not a terminal
+    output = Output(stream)
+    output.char(ord('A'))
+    assert stream.getvalue() == b''
+    output.char(10)
+    assert stream.getvalue() == b'A\n'
+    output.char(ord('B'))
+    output.poll()
+    assert stream.getvalue() == b'A\nB'
+    output.number(42)
+    assert stream.getvalue() == b'A\nB42\n'
+
+
+def test_threshold():
+    sink = bytearray()
+    output = Output(sink, threshold=4)
+    for code in b'abcd':
+        output.char(code)
+    assert sink == b'abcd'
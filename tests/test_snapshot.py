@@ -0,0 +1,53 @@
+"""Restoring a snapshot resumes the run it was taken from."""
+
+import io
+import os
+
+import pytest
+
+from cpu import CPU, ENGINES
+from keyboard import Keyboard
+from output import Output
+from timer import VirtualTimer
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'ls8', 'examples')
+
+
+def machine(engine, output):
+    return CPU(engine=engine, timer=VirtualTimer(13),
+               keyboard=Keyboard(io.StringIO()), output=Output(output))
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('at', [0, 37, 39])
+def test_restore_keeps_timer(engine, at):
+    original, copy = bytearray(), bytearray()
+    cpu = machine(engine, original)
+    cpu.load(os.path.join(EXAMPLES, 'interrupts.ls8'))
+    cpu.step(at)
+    restored = machine(engine, copy)
+    restored.restore(cpu.snapshot())
+    for _ in range(60):
+        cpu.step()
+        restored.step()
+        assert restored.snapshot() == cpu.snapshot()
+        assert copy == original[len(original) - len(copy):]
+
+
+def test_wide_round_trip():
+    cpu = CPU(engine='fast', bits=16, timer=VirtualTimer(13),
+              keyboard=Keyboard(io.StringIO()), output=Output(bytearray()))
+    # LDI R0,0; JMP R0 with IM above a byte, so interrupts save it
+    cpu.ram[:6] = bytes([0x82, 0, 0, 0, 0x54, 0])
+    cpu.reg[5] = 0x101
+    cpu.step(20)
+    restored = CPU(engine='fast', bits=16, timer=VirtualTimer(13),
+                   keyboard=Keyboard(io.StringIO()),
+                   output=Output(bytearray()))
+    restored.restore(cpu.snapshot())
+    assert restored.snapshot() == cpu.snapshot()
+    assert restored._old_IM == 0x101
+    cpu.step(40)
+    restored.step(40)
+    assert restored.snapshot() == cpu.snapshot()
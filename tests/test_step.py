@@ -0,0 +1,57 @@
+"""Resuming runs with CPU.step."""
+
+import io
+
+import pytest
+
+from cpu import CPU, FAULT, HALT, LIMIT
+from keyboard import Keyboard
+from output import Output
+from timer import VirtualTimer
+
+
+@pytest.mark.parametrize('engine', ['checked', 'fast'])
+@pytest.mark.parametrize('patch', ['ram', 'register'])
+def test_patched_between_steps(engine, patch):
+    cpu = CPU(engine=engine, timer=VirtualTimer(1000),
+              keyboard=Keyboard(io.StringIO()), output=Output(bytearray()))
+    # LDI R0,0; JMP R0, a loop proven to stay below the stack
+    cpu.ram[:5] = bytes([0x82, 0, 0, 0x54, 0])
+    assert cpu.step(10) == LIMIT
+    # run through the NOPs above the code into the stack area instead
+    if patch == 'ram':
+        cpu.ram_write(2, 0xF0)
+    else:
+        for address in range(3):
+            cpu.ram_write(address, 0)  # NOP the LDI R0
+        cpu.reg[0] = 0xF0
+    assert cpu.step(10) == FAULT
+    assert str(cpu.fault) == 'invalid program counter: 244, stack: 244'
+
+
+class CountingKeyboard(Keyboard):
+    starts = stops = 0
+
+    def start(self):
+        self.starts += 1
+        super().start()
+
+    def stop(self):
+        self.stops += 1
+        super().stop()
+
+
+@pytest.mark.parametrize('engine', ['checked', 'fast', 'jit'])
+def test_devices_started_once(engine):
+    keyboard = CountingKeyboard(io.StringIO())
+    cpu = CPU(engine=engine, timer=VirtualTimer(1000), keyboard=keyboard,
+              output=Output(bytearray()))
+    # LDI R0,3; JMP R0 spins, then HLT is patched in
+    cpu.ram[:5] = bytes([0x82, 0, 3, 0x54, 0])
+    for _ in range(5):
+        assert cpu.step(10) == LIMIT
+    assert (keyboard.starts, keyboard.stops) == (1, 0)
+    cpu.ram_write(3, 1)
+    cpu.ram_write(4, 1)
+    assert cpu.step(10) == HALT
+    assert (keyboard.starts, keyboard.stops) == (1, 1)
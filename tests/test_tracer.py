@@ -0,0 +1,50 @@
+"""Trace records of a partly filled and of a wrapped ring buffer."""
+
+import io
+
+from cpu import CPU, FAULT
+from keyboard import Keyboard
+from output import Output
+from timer import VirtualTimer
+
+
+def traced(program, depth):
+    """Step program to its fault with a trace of depth, return the CPU."""
+    cpu = CPU(engine='fast', timer=VirtualTimer(1000), trace=depth,
+              keyboard=Keyboard(io.StringIO()), output=Output(bytearray()))
+    cpu.ram[:len(program)] = bytes(program)
+    assert cpu.step(100) == FAULT
+    return cpu
+
+
+def test_partly_filled():
+    # LDI R7,3 moves the stack into its own code
+    cpu = traced([0x82, 7, 3], 8)
+    dump = io.StringIO()
+    cpu.trace.dump(dump)
+    assert dump.getvalue().splitlines()[1:] == \
+        ['TRACE: 00 | 82 07 03 | 00 | 00 00 00 00 00 00 00 F4']
+
+
+def test_wrapped():
+    # nine LDI R0,n then POP R1 with an empty stack
+    program = [byte for n in range(9) for byte in (0x82, 0, n)] + [0x46, 1]
+    cpu = traced(program, 4)
+    assert [record[:4] for record in cpu.trace.records()] == [
+        (18, 0x82, 0, 6), (21, 0x82, 0, 7), (24, 0x82, 0, 8), (27, 0x46, 1, 0),
+    ]
+
+
+def test_engines_agree():
+    # a loop counting R0 down from 3, then an invalid opcode
+    program = [0x82, 0, 3, 0x82, 2, 6, 0x66, 0, 0xA7, 0, 3, 0x55, 2, 0xEE]
+    records = []
+    for engine in ('checked', 'fast', 'jit'):
+        cpu = CPU(engine=engine, timer=VirtualTimer(1000), trace=64,
+                  keyboard=Keyboard(io.StringIO()), output=Output(bytearray()))
+        cpu.ram[:len(program)] = bytes(program)
+        assert cpu.step(100) == FAULT
+        records.append(cpu.trace.records())
+    assert records[0][-1][:4] == (13, 0xEE, 0, 0)
+    assert records[1] == records[0]
+    assert records[2] == records[0]